@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, timedelta
 
 from decouple import config as env
@@ -10,11 +11,13 @@ from sqlalchemy import (
     Integer,
     String,
     create_engine,
+    inspect,
+    text,
 )
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import object_session, relationship, scoped_session, sessionmaker
-from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
 
 Base = declarative_base()
 uri = env("DATABASE_URI")
@@ -66,6 +69,27 @@ class Source(Base):
         _session.add(self)
         _session.commit()
 
+    def save_states(self, states):
+        """Only update the given ids of the state, in one statement.
+        Called from the threads of the crawler: it uses its own connection,
+        not the session of the object (sessions aren't thread-safe).
+        """
+        with engine.begin() as connection:
+            state = connection.execute(
+                text(
+                    """
+                    UPDATE sources
+                    SET state = COALESCE(state, '{}'::jsonb) || CAST(:states AS jsonb)
+                    WHERE id = :id
+                    RETURNING state
+                    """
+                ),
+                # The identity, `self.id` may be expired and loaded by the session
+                {"states": json.dumps(states), "id": inspect(self).identity[0]},
+            ).scalar()
+        # Up to date without a query of the session, and not marked as modified
+        set_committed_value(self, "state", state)
+
     def load_state(self, id):
         if self.state is None:
             return {}
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+def request_key(method, url, params=None, body=None, headers=None):
+    """Hash of everything that makes a request (headers include the credentials)"""
+    key = json.dumps(
+        [method.upper(), url, params, body, sorted((headers or {}).items())],
+        default=str,
+    )
+    return hashlib.sha1(key.encode("UTF-8")).hexdigest()
+
+
+class CachedResponse:
+    def __init__(self, url, status_code, headers, content, stored_at):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.stored_at = stored_at
+
+    @property
+    def validators(self):
+        """Headers to revalidate the response with a conditional request"""
+        validators = {}
+        if "ETag" in self.headers:
+            validators["If-None-Match"] = self.headers["ETag"]
+        if "Last-Modified" in self.headers:
+            validators["If-Modified-Since"] = self.headers["Last-Modified"]
+        return validators
+
+    def is_fresh(self, ttl):
+        return ttl is not None and self.stored_at + ttl > time.time()
+
+    def to_response(self):
+        response = requests.Response()
+        response.url = self.url
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.from_cache = True
+        return response
+
+
+class ResponseCache:
+    """Responses stored on disk, compressed, one file per request.
+    When the total size goes over `max_size`, the least recently used
+    responses are evicted (the mtime of a file is its last use).
+    """
+
+    def __init__(self, path, max_size=1024**3):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(os.path.getsize(file) for file in self._files())
+
+    def _files(self):
+        return [
+            os.path.join(self.path, name)
+            for name in os.listdir(self.path)
+            if name.endswith(".zlib")
+        ]
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.zlib")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), "rb") as f:
+                data = zlib.decompress(f.read())
+            os.utime(self._file(key))
+        except (FileNotFoundError, zlib.error):
+            return None
+
+        meta, content = data.split(b"\n", 1)
+        meta = json.loads(meta)
+        return CachedResponse(content=content, **meta)
+
+    def set(self, key, response, stored_at=None):
+        meta = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "stored_at": stored_at or time.time(),
+        }
+        data = zlib.compress(
+            json.dumps(meta).encode("UTF-8") + b"\n" + response.content
+        )
+
+        with self.lock:
+            file = self._file(key)
+            previous_size = os.path.getsize(file) if os.path.exists(file) else 0
+            with open(file, "wb") as f:
+                f.write(data)
+            self.size += len(data) - previous_size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used files, until 90% of max_size"""
+        files = sorted(self._files(), key=os.path.getmtime)
+        for file in files:
+            if self.size <= self.max_size * 0.9:
+                break
+            try:
+                size = os.path.getsize(file)
+                os.remove(file)
+            except FileNotFoundError:
+                continue
+            self.size -= size
@@ -0,0 +1,64 @@
+import copy
+import threading
+import time
+
+
+class CheckpointWriter:
+    """Merge the state updates of the routes, and write them to the memory
+    every `interval` seconds or every `pages` updates, whichever comes first.
+    `flush` must be called at the end of the run (even on failure).
+
+    Writes are batched, not asynchronous: a write runs in the thread whose
+    `save` made it due (a route, or the loader once the items are loaded).
+    """
+
+    def __init__(self, memory, interval=30, pages=50):
+        self.memory = memory
+        self.interval = interval
+        self.pages = pages
+        self.pending = {}
+        self.count = 0
+        self.flushed_at = time.monotonic()
+        self.lock = threading.RLock()
+        # One write at a time, in order, without blocking `save` meanwhile
+        self.write_lock = threading.Lock()
+
+    def save(self, id, state):
+        with self.lock:
+            # Copy, the route keeps updating its state
+            self.pending[id] = copy.deepcopy(state)
+            self.count += 1
+            due = (
+                self.count >= self.pages
+                or time.monotonic() - self.flushed_at >= self.interval
+            )
+        # Skipped while another thread writes, the next save will flush
+        if due and self.write_lock.acquire(blocking=False):
+            try:
+                self._write()
+            finally:
+                self.write_lock.release()
+
+    def flush(self):
+        with self.write_lock:
+            self._write()
+
+    def _write(self):
+        with self.lock:
+            states, self.pending = self.pending, {}
+            self.count = 0
+            self.flushed_at = time.monotonic()
+        if not states:
+            return
+
+        try:
+            if hasattr(self.memory, "save_states"):
+                self.memory.save_states(states)
+            else:
+                for id, state in states.items():
+                    self.memory.save_state(id, state)
+        except Exception:
+            # Written with the next flush, unless updated meanwhile
+            with self.lock:
+                self.pending = {**states, **self.pending}
+            raise
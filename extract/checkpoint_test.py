@@ -0,0 +1,69 @@
+import os
+import sys
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.checkpoint import CheckpointWriter
+
+
+class Memory:
+    def __init__(self):
+        self.states = {}
+        self.writing = threading.Lock()
+        self.overlaps = 0
+
+    def save_states(self, states):
+        if not self.writing.acquire(blocking=False):
+            self.overlaps += 1
+            return
+        try:
+            time.sleep(0.001)
+            self.states.update(states)
+        finally:
+            self.writing.release()
+
+
+def test_concurrent_saves():
+    memory = Memory()
+    checkpoint = CheckpointWriter(memory, pages=3)
+
+    def route(id):
+        for cursor in range(100):
+            checkpoint.save(id, {"cursor": cursor})
+
+    threads = [threading.Thread(target=route, args=(id,)) for id in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    checkpoint.flush()
+
+    assert memory.overlaps == 0
+    assert memory.states == {id: {"cursor": 99} for id in range(8)}
+
+
+def test_failed_write_is_retried():
+    class FailingMemory(Memory):
+        def save_states(self, states):
+            if not self.states:
+                self.states = {"failed": True}
+                raise ValueError("Can't save")
+            super().save_states(states)
+
+    memory = FailingMemory()
+    checkpoint = CheckpointWriter(memory)
+    checkpoint.save("route", {"cursor": 1})
+    try:
+        checkpoint.flush()
+    except ValueError:
+        pass
+    checkpoint.flush()
+    assert memory.states == {"failed": True, "route": {"cursor": 1}}
+
+
+if __name__ == "__main__":
+    test_concurrent_saves()
+    test_failed_write_is_retried()
@@ -0,0 +1,78 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class RequestCoalescer:
+    """Share the responses of identical requests between the crawlers of the
+    process (eg: several pipelines on the same public source).
+
+    While a request is in flight, the same request waits for its response
+    instead of being sent again; the response is then reused for `ttl` seconds,
+    once by each other `owner` (a session). The owner of a response, or one
+    that already got it, sends the request again: it's a retry (eg: of an
+    empty page), it must not read the same response.
+    Errors are not shared once the request is done.
+    """
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.in_flight = {}  # key -> Future
+        self.in_flight_owners = {}  # key -> owners waiting for it
+        # key -> (done_at, response, owners that got it), oldest first
+        self.recent = OrderedDict()
+
+    def _expire(self, now):
+        while self.recent:
+            key, (done_at, _, _) = next(iter(self.recent.items()))
+            if done_at + self.ttl > now:
+                return
+            del self.recent[key]
+
+    def request(self, key, func, owner=None):
+        """Return (response, coalesced), `func` is only called when needed"""
+        with self.lock:
+            self._expire(time.monotonic())
+            if key in self.recent:
+                _, response, owners = self.recent[key]
+                if owner not in owners:
+                    owners.add(owner)
+                    return self._copy(response), True
+            future = self.in_flight.get(key)
+            owner_of_request = future is None
+            if owner_of_request:
+                future = self.in_flight[key] = Future()
+                self.in_flight_owners[key] = {owner}
+            else:
+                self.in_flight_owners[key].add(owner)
+
+        if not owner_of_request:
+            return self._copy(future.result()), True
+
+        try:
+            response = func()
+        except BaseException as err:
+            with self.lock:
+                del self.in_flight[key]
+                del self.in_flight_owners[key]
+            future.set_exception(err)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            owners = self.in_flight_owners.pop(key)
+            if response.ok:
+                self.recent.pop(key, None)  # Ordered by done_at
+                self.recent[key] = (time.monotonic(), response, owners)
+        future.set_result(response)
+        return response, False
+
+    def _copy(self, response):
+        # Each crawler gets its own object. A 304 only means "already loaded"
+        # for the crawler that revalidated it.
+        response = copy.copy(response)
+        response.not_modified = False
+        return response
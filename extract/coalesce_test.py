@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.coalesce import RequestCoalescer
+
+
+class Response:
+    ok = True
+
+
+def test_coalesce_in_flight_and_recent():
+    coalescer = RequestCoalescer(ttl=60)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.1)
+        return Response()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda owner: results.append(coalescer.request("a", fetch, owner)),
+            args=(owner,),
+        )
+        for owner in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(coalesced for _, coalesced in results) == [False] + [True] * 4
+
+    # Fresh, reused without waiting by another owner, once
+    assert coalescer.request("a", fetch, 5)[1] is True
+    assert coalescer.request("b", fetch, 0)[1] is False
+    assert len(calls) == 2
+
+
+def test_retries_are_sent():
+    coalescer = RequestCoalescer(ttl=60)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return Response()
+
+    assert coalescer.request("a", fetch, "owner")[1] is False
+    # The same owner sends it again (eg: a retry)
+    assert coalescer.request("a", fetch, "owner")[1] is False
+    assert coalescer.request("a", fetch, "other")[1] is True
+    assert coalescer.request("a", fetch, "other")[1] is False
+    assert len(calls) == 3
+
+
+def test_errors_are_not_kept():
+    coalescer = RequestCoalescer(ttl=60)
+
+    def fail():
+        raise ValueError("boom")
+
+    try:
+        coalescer.request("a", fail)
+    except ValueError:
+        pass
+    assert coalescer.request("a", Response) == (coalescer.recent["a"][1], False)
+
+
+if __name__ == "__main__":
+    test_coalesce_in_flight_and_recent()
+    test_errors_are_not_kept()
@@ -0,0 +1,194 @@
+import ast
+import functools
+import operator
+
+# Names an expression of the pagination can read
+NAMES = ("response", "results", "cursor")
+
+FUNCTIONS = {
+    "len": len,
+    "int": int,
+    "float": float,
+    "str": str,
+    "bool": bool,
+    "min": min,
+    "max": max,
+}
+
+BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+UNARY_OPERATORS = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+COMPARE_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+}
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def get_key(value, key):
+    """`value.key` is read as `value['key']` (the responses are json)"""
+    if isinstance(value, dict):
+        return value[key]
+    raise ExpressionError(f"Can't read .{key} of {type(value).__name__}")
+
+
+class Expression:
+    """A python expression, restricted to reading the response:
+    names in `NAMES`, constants, subscripts, `.key` on dicts, arithmetic,
+    comparisons, boolean operators and a few builtins (`FUNCTIONS`).
+    It's compiled into nested functions, and never goes through `eval`.
+    """
+
+    def __init__(self, text, names=NAMES):
+        self.text = text
+        self.names = names
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as err:
+            raise ExpressionError(f"Invalid expression {text!r}: {err.msg}")
+        self.func = self._compile(tree.body)
+
+    def __call__(self, **values):
+        return self.func(values)
+
+    def __repr__(self):
+        return f"Expression({self.text!r})"
+
+    def _error(self, node, message):
+        return ExpressionError(
+            f"{message} in {self.text!r} (column {node.col_offset + 1})"
+        )
+
+    def _compile(self, node):
+        compile = self._compile
+
+        if isinstance(node, ast.Constant):
+            value = node.value
+            return lambda values: value
+
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name not in self.names:
+                raise self._error(node, f"Unknown name {name}")
+            return lambda values: values[name]
+
+        if isinstance(node, ast.Subscript):
+            value, key = compile(node.value), compile(node.slice)
+            return lambda values: value(values)[key(values)]
+
+        if isinstance(node, ast.Slice):
+            parts = [
+                compile(part) if part else (lambda values: None)
+                for part in (node.lower, node.upper, node.step)
+            ]
+            return lambda values: slice(*(part(values) for part in parts))
+
+        if isinstance(node, ast.Attribute):
+            if node.attr.startswith("__"):
+                raise self._error(node, f"Private attribute {node.attr}")
+            value, key = compile(node.value), node.attr
+            return lambda values: get_key(value(values), key)
+
+        if isinstance(node, (ast.List, ast.Tuple)):
+            items = [compile(item) for item in node.elts]
+            return lambda values: [item(values) for item in items]
+
+        if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+            op = BINARY_OPERATORS[type(node.op)]
+            left, right = compile(node.left), compile(node.right)
+            return lambda values: op(left(values), right(values))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+            op, operand = UNARY_OPERATORS[type(node.op)], compile(node.operand)
+            return lambda values: op(operand(values))
+
+        if isinstance(node, ast.BoolOp):
+            operands = [compile(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+
+                def and_(values):
+                    result = True
+                    for operand in operands:
+                        result = operand(values)
+                        if not result:
+                            return result
+                    return result
+
+                return and_
+
+            def or_(values):
+                result = False
+                for operand in operands:
+                    result = operand(values)
+                    if result:
+                        return result
+                return result
+
+            return or_
+
+        if isinstance(node, ast.Compare):
+            left = compile(node.left)
+            comparisons = []
+            for op, comparator in zip(node.ops, node.comparators):
+                if type(op) not in COMPARE_OPERATORS:
+                    raise self._error(node, f"Unsupported operator {type(op).__name__}")
+                comparisons.append((COMPARE_OPERATORS[type(op)], compile(comparator)))
+
+            def compare(values):
+                a = left(values)
+                for op, comparator in comparisons:
+                    b = comparator(values)
+                    if not op(a, b):
+                        return False
+                    a = b
+                return True
+
+            return compare
+
+        if isinstance(node, ast.IfExp):
+            test, body, orelse = (
+                compile(node.test),
+                compile(node.body),
+                compile(node.orelse),
+            )
+            return lambda values: body(values) if test(values) else orelse(values)
+
+        if isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+                raise self._error(node, "Only calls to " + ", ".join(FUNCTIONS))
+            if node.keywords:
+                raise self._error(node, "Keyword arguments aren't supported")
+            func = FUNCTIONS[node.func.id]
+            args = [compile(arg) for arg in node.args]
+            return lambda values: func(*(arg(values) for arg in args))
+
+        raise self._error(node, f"Unsupported syntax {type(node).__name__}")
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(text):
+    """Expressions are compiled once per process (first at validation)"""
+    return Expression(text)
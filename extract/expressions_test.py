@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.expressions import Expression, ExpressionError
+from extract.registry import registry
+
+
+def test_expressions():
+    response = {"page_count": 3, "items": [{"response_id": "a"}, {"response_id": "b"}]}
+    stop = Expression("response['page_count'] == cursor")
+    assert stop(response=response, results=[], cursor=3) is True
+    assert stop(response=response, results=[], cursor=2) is False
+
+    ref = Expression("response['items'][-1].response_id")
+    assert ref(response=response, results=[], cursor=None) == "b"
+
+    assert Expression("len(results) < 100 and not cursor")(
+        response={}, results=[1], cursor=0
+    )
+    assert Expression("cursor + 1 if cursor else 0")(cursor=4) == 5
+
+
+def test_unsafe_expressions():
+    for text in [
+        "__import__('os').system('ls')",
+        "open('/etc/passwd')",
+        "response.__class__",
+        "[x for x in results]",
+        "lambda: 1",
+        "os",
+    ]:
+        with pytest.raises(ExpressionError):
+            Expression(text)(response={}, results=[], cursor=None)
+
+
+def test_source_expressions():
+    # All the sources are validated, with their pagination expressions
+    for name in registry.names():
+        registry.get(name)
+
+
+if __name__ == "__main__":
+    test_expressions()
+    test_unsafe_expressions()
+    test_source_expressions()
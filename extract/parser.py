@@ -4,23 +4,66 @@ import feedparser
 import xmltodict
 
 
-def encode_feedparser_dict(d):
-    """helper function to strip feedparser objects using a deep copy"""
-    if isinstance(d, feedparser.FeedParserDict) or isinstance(d, dict):
-        return {
-            k: encode_feedparser_dict(d[k])
-            for k in d.keys()
-            if not isinstance(d[k], time.struct_time)
-        }
-    elif isinstance(d, list):
-        return [encode_feedparser_dict(k) for k in d]
-    else:
-        return d
+def strip_struct_time(d):
+    """Drop the time.struct_time values (*_parsed) of a feedparser dict, in place"""
+    for key in [k for k, v in d.items() if isinstance(v, time.struct_time)]:
+        del d[key]
+    return d
+
+
+def normalize_feed(parsed):
+    """Strip the struct_time values where feedparser puts them: the result, its
+    feed, the entries and their source feed. In place, the feed isn't copied
+    (FeedParserDict is already a dict).
+    """
+    for d in (parsed, parsed.get("feed", {}), *parsed.get("entries", [])):
+        strip_struct_time(d)
+        if isinstance(d.get("source"), dict):
+            strip_struct_time(d["source"])
+    return parsed
 
 
 def atom_parse(response):
     parsed = feedparser.parse(response)
-    return encode_feedparser_dict(parsed)
+    return normalize_feed(parsed)
+
+
+def json_stream(file, key=None, batch_size=1000):
+    """Parse a json file incrementally,
+    yield the items of the array at `key` (eg: 'data.items') by batches
+    """
+    import ijson
+
+    prefix = f"{key}.item" if key else "item"
+    batch = []
+    for item in ijson.items(file, prefix, use_float=True):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def xml_stream(file, key, callback, batch_size=1000):
+    """Parse a xml file incrementally,
+    call `callback` with batches of the elements at `key` (eg: 'feed.entry').
+    Elements are dropped from the parsed tree once passed to the callback.
+    """
+    path = key.split(".")
+    batch = []
+
+    def item_callback(item_path, item):
+        if [name for name, _ in item_path] == path:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                callback(list(batch))
+                batch.clear()
+        return True
+
+    xmltodict.parse(file, item_depth=len(path), item_callback=item_callback)
+    if batch:
+        callback(batch)
 
 
 def xml_parse(content):
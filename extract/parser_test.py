@@ -0,0 +1,49 @@
+import json
+import os
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.parser import atom_parse, normalize_feed
+
+FEED = """<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>Feed</title>
+  <updated>2024-01-02T00:00:00Z</updated>
+  <entry>
+    <title>Entry</title>
+    <id>1</id>
+    <updated>2024-01-01T00:00:00Z</updated>
+    <published>2024-01-01T00:00:00Z</published>
+  </entry>
+</feed>
+"""
+
+
+def test_atom_parse_strips_nested_struct_time():
+    parsed = atom_parse(FEED)
+    json.dumps(parsed)  # struct_time isn't serializable
+    assert parsed["feed"]["updated"] == "2024-01-02T00:00:00Z"
+    assert "updated_parsed" not in parsed["feed"]
+    entry = parsed["entries"][0]
+    assert entry["title"] == "Entry"
+    assert "updated_parsed" not in entry and "published_parsed" not in entry
+
+
+def test_normalize_feed_in_place():
+    now = time.gmtime()
+    entry = {"title": "a", "updated_parsed": now, "source": {"updated_parsed": now}}
+    parsed = {
+        "updated_parsed": now,
+        "feed": {"updated_parsed": now},
+        "entries": [entry],
+    }
+    assert normalize_feed(parsed) is parsed
+    assert parsed == {"feed": {}, "entries": [{"title": "a", "source": {}}]}
+
+
+if __name__ == "__main__":
+    test_atom_parse_strips_nested_struct_time()
+    test_normalize_feed_in_place()
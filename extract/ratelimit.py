@@ -0,0 +1,175 @@
+import email.utils
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+# Responses slowing down the host
+LIMIT_STATUSES = (429, 503)
+
+
+def parse_retry_after(value):
+    """Retry-After is either a number of seconds or a HTTP date"""
+    if not value:
+        return 0
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0
+    return max(date.timestamp() - time.time(), 0)
+
+
+class MemoryStore:
+    """Limiter state of the hosts, shared by the threads of the process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def update(self, host, func):
+        """Apply `func` on the state of the host, atomically"""
+        with self.lock:
+            state = func(self.hosts.get(host))
+            self.hosts[host] = state
+            return state
+
+
+class SqliteStore:
+    """Limiter state of the hosts, in a sqlite file shared by the processes"""
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                host TEXT PRIMARY KEY,
+                tat REAL,
+                rate REAL,
+                paused_until REAL
+            )
+            """
+        )
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def update(self, host, func):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # Lock the file until commit
+            row = conn.execute(
+                "SELECT tat, rate, paused_until FROM rate_limits WHERE host = ?",
+                (host,),
+            ).fetchone()
+            state = func(
+                dict(zip(("tat", "rate", "paused_until"), row)) if row else None
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?)",
+                (host, state["tat"], state["rate"], state["paused_until"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return state
+
+
+class HostLimiter:
+    """Rate limit of one host (GCRA, equivalent to a token bucket of `burst` tokens)
+
+    The rate is halved on 429/503, and requests are paused for the Retry-After
+    delay. Each successful response then increases it back by 1% of `max_rate`.
+    """
+
+    def __init__(self, host, max_rate, store, burst=1, min_rate=0.1):
+        self.host = host
+        self.max_rate = max_rate
+        self.store = store
+        self.burst = burst
+        self.min_rate = min_rate
+
+    def _state(self, state):
+        if state is None:
+            return {"tat": 0, "rate": self.max_rate, "paused_until": 0}
+        state["rate"] = min(state["rate"], self.max_rate)
+        return state
+
+    def acquire(self):
+        """Wait until the next request can be sent"""
+        now = time.time()
+        at = None
+
+        def reserve(state):
+            nonlocal at
+            state = self._state(state)
+            interval = 1 / state["rate"]
+            at = max(
+                now,
+                state["tat"] - (self.burst - 1) * interval,
+                state["paused_until"],
+            )
+            state["tat"] = max(state["tat"], at) + interval
+            return state
+
+        self.store.update(self.host, reserve)
+        if at > now:
+            time.sleep(at - now)
+
+    def update(self, response):
+        """Slow down or speed up depending on the response"""
+
+        def adapt(state):
+            state = self._state(state)
+            if response.status_code in LIMIT_STATUSES:
+                state["rate"] = max(state["rate"] / 2, self.min_rate)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                state["paused_until"] = max(
+                    state["paused_until"], time.time() + retry_after
+                )
+            elif state["rate"] < self.max_rate:
+                state["rate"] = min(state["rate"] + self.max_rate / 100, self.max_rate)
+            return state
+
+        self.store.update(self.host, adapt)
+
+
+class LimiterRegistry:
+    """One limiter per host for the whole process.
+    When several sessions hit the same host, the lowest of their rates is kept,
+    until the session is released (at the end of its run).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.limiters = {}
+        self.rates = {}  # host -> {session: rate}
+
+    def get(self, url, rate, session=None):
+        host = urlparse(url).netloc
+        with self.lock:
+            limiter = self.limiters.get(host)
+            if limiter is None:
+                limiter = HostLimiter(host, rate, self.store)
+                self.limiters[host] = limiter
+            rates = self.rates.setdefault(host, {})
+            if rates.get(session) != rate:
+                rates[session] = rate
+                limiter.max_rate = min(rates.values())
+            return limiter
+
+    def release(self, session):
+        """Stop applying the rate of `session` to its hosts"""
+        with self.lock:
+            for host, rates in self.rates.items():
+                if rates.pop(session, None) is not None and rates:
+                    self.limiters[host].max_rate = min(rates.values())
@@ -0,0 +1,61 @@
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.ratelimit import (
+    HostLimiter,
+    LimiterRegistry,
+    MemoryStore,
+    parse_retry_after,
+)
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) == 0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0  # in the past
+    assert parse_retry_after("not a date") == 0
+
+
+def test_limiter_slow_down_and_recover():
+    store = MemoryStore()
+    limiter = HostLimiter("host", 10, store)
+
+    limiter.update(Response(429, {"Retry-After": "2"}))
+    state = store.hosts["host"]
+    assert state["rate"] == 5
+    assert state["paused_until"] > 0
+
+    for _ in range(10):
+        limiter.update(Response(200))
+    assert round(store.hosts["host"]["rate"], 6) == 6
+
+    for _ in range(100):
+        limiter.update(Response(200))
+    assert store.hosts["host"]["rate"] == 10
+
+
+def test_registry_restores_rate():
+    registry = LimiterRegistry(MemoryStore())
+    fast, slow = object(), object()
+    limiter = registry.get("https://host/a", 20, fast)
+    assert registry.get("https://host/b", 2, slow) is limiter
+    assert limiter.max_rate == 2  # the lowest rate wins
+    registry.release(slow)
+    assert limiter.max_rate == 20
+    registry.release(fast)
+    assert registry.get("https://host/a", 5, fast).max_rate == 5
+
+
+if __name__ == "__main__":
+    test_parse_retry_after()
+    test_limiter_slow_down_and_recover()
+    test_registry_restores_rate()
@@ -0,0 +1,197 @@
+import json
+import os
+import threading
+from functools import cached_property
+from types import MappingProxyType
+
+import yaml
+
+from extract.expressions import ExpressionError, compile_expression
+from extract.utils import PropertyTree, Projection, apply_nested, partial_format
+
+SOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sources")
+STRATEGIES = ("Looping", "DirectFetch", "List", "Listing", "Slicing")
+
+
+class SourceConfigError(Exception):
+    pass
+
+
+class FrozenTree(PropertyTree):
+    """Read-only PropertyTree, the dotted paths are resolved once"""
+
+    def __init__(self, values):
+        paths = {}
+        for key, value in values.items():
+            value = freeze(value)
+            object.__setattr__(self, key, value)
+            paths[key] = value
+            if isinstance(value, FrozenTree):
+                for path, sub_value in value._paths.items():
+                    paths[f"{key}.{path}"] = sub_value
+        object.__setattr__(self, "_paths", paths)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"Source config is read-only (can't set {key})")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"Source config is read-only (can't delete {key})")
+
+    def dict(self):
+        item = {}
+        for k, v in self.__dict__.items():
+            if k in ("_paths", "mapping"):
+                continue
+            if isinstance(v, FrozenTree):
+                item[k] = v.dict()
+            elif isinstance(v, tuple):
+                item[k] = [sv.dict() if isinstance(sv, FrozenTree) else sv for sv in v]
+            else:
+                item[k] = v
+        return item
+
+    def select(self, path, fallback=None):
+        value = self._paths.get(path)
+        if value is None:
+            return fallback
+        if isinstance(value, FrozenTree):
+            return value.mapping
+        return value
+
+    @cached_property
+    def mapping(self):
+        """The tree as a read-only dict, converted once"""
+        return MappingProxyType(self.dict())
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenTree(value)
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def validate(name, config):
+    """Check the source config has what the crawler and the loader need"""
+    for key in ("id", "host", "routes", "entities"):
+        if key not in config:
+            raise SourceConfigError(f"{name}: missing {key}")
+
+    entities = config["entities"]
+    for entity, entity_config in entities.items():
+        # Either the list of keys, or {keys, fields, exclude}
+        if isinstance(entity_config, dict):
+            if "keys" not in entity_config:
+                raise SourceConfigError(f"{name}: entity {entity} missing keys")
+            for key in ("fields", "exclude"):
+                if not isinstance(entity_config.get(key, []), list):
+                    raise SourceConfigError(
+                        f"{name}: entity {entity} {key} should be a list of paths"
+                    )
+    for route in config["routes"]:
+        route_id = route.get("id")
+        for key in ("id", "entity", "type", "format"):
+            if key not in route:
+                raise SourceConfigError(f"{name}: route {route_id} missing {key}")
+        if route["type"] not in STRATEGIES:
+            raise SourceConfigError(
+                f"{name}: route {route_id} unknown type {route['type']}"
+            )
+        if route["entity"] not in entities:
+            raise SourceConfigError(
+                f"{name}: route {route_id} entity {route['entity']} has no keys"
+            )
+        if "batch" in route:
+            if route["type"] not in ("Looping", "DirectFetch"):
+                raise SourceConfigError(
+                    f"{name}: route {route_id} batch is only for Looping and DirectFetch"
+                )
+            if route["type"] == "DirectFetch" and "dependencies" not in route:
+                # Only the ids of the parent items are batched
+                raise SourceConfigError(
+                    f"{name}: route {route_id} batch needs dependencies on DirectFetch"
+                )
+            if "request" not in route["batch"]:
+                raise SourceConfigError(
+                    f"{name}: route {route_id} batch missing request"
+                )
+        for key in ("stop_func", "ref_func"):
+            expression = route.get("pagination", {}).get(key)
+            if expression is None:
+                continue
+            try:
+                compile_expression(expression)
+            except ExpressionError as err:
+                raise SourceConfigError(f"{name}: route {route_id} {key}: {err}")
+
+
+class SourceConfig:
+    """A source file, parsed and validated once"""
+
+    def __init__(self, name, raw):
+        self.name = name
+        self.raw = raw  # Not to be modified
+        self.tree = FrozenTree(raw)
+        self.projections = {}
+        for entity, entity_config in raw["entities"].items():
+            if isinstance(entity_config, dict) and (
+                "fields" in entity_config or "exclude" in entity_config
+            ):
+                self.projections[entity] = Projection(
+                    entity_config.get("fields"), entity_config.get("exclude")
+                )
+
+    def compile(self, params=None):
+        """Config tree with the params of the client formatted in"""
+        if not params:
+            return self.tree
+        return FrozenTree(apply_nested(self.raw, lambda x: partial_format(x, **params)))
+
+    def entity_keys(self, entity):
+        keys = self.raw["entities"].get(entity)
+        if isinstance(keys, dict):
+            keys = keys["keys"]
+        if keys is None:
+            raise ValueError(f"Keys not found for entity {entity}")
+        return keys
+
+    def entity_projection(self, entity):
+        """Projection of the items of the entity, None to keep them whole"""
+        return self.projections.get(entity)
+
+
+class SourceRegistry:
+    """Source configs, reloaded when their file changes"""
+
+    def __init__(self, path=SOURCES_DIR):
+        self.path = path
+        self.lock = threading.Lock()
+        self.sources = {}  # name -> (mtime, SourceConfig)
+
+    def names(self):
+        return sorted(
+            name[: -len(".yml")]
+            for name in os.listdir(self.path)
+            if name.endswith(".yml")
+        )
+
+    def get(self, name):
+        file = os.path.join(self.path, f"{name}.yml")
+        mtime = os.stat(file).st_mtime_ns
+        with self.lock:
+            cached = self.sources.get(name)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            with open(file) as f:
+                raw = yaml.safe_load(f)
+            # Keep a json-like copy (yaml may share nodes between keys)
+            raw = json.loads(json.dumps(raw))
+            validate(name, raw)
+            source = SourceConfig(name, raw)
+            self.sources[name] = (mtime, source)
+            return source
+
+
+registry = SourceRegistry()
@@ -0,0 +1,70 @@
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.registry import FrozenTree, SourceConfigError, registry, validate
+
+
+def test_sources_are_valid():
+    for name in registry.names():
+        source = registry.get(name)
+        assert source.tree.id == name
+
+
+def test_frozen_tree_select():
+    tree = FrozenTree({"a": {"b": {"c": 1}}, "d": [{"e": 2}]})
+    assert tree.select("a.b.c") == 1
+    assert tree.select("a.b") == {"c": 1}
+    assert tree.select("a.b") is tree.select("a.b")  # Converted once
+    try:
+        tree.select("a.b")["c"] = 2
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("select returned a mutable dict")
+    assert tree.select("a.x", 3) == 3
+    assert tree.d[0].e == 2
+    assert tree.dict() == {"a": {"b": {"c": 1}}, "d": [{"e": 2}]}
+
+
+def test_compile_with_params():
+    source = registry.get("airtable")
+    tree = source.compile({"baseId": "base", "idToken": "token"})
+    assert tree.routes[0].request.url == "/meta/bases/base/tables"
+    assert tree.select("headers")["Authorization"] == "Bearer token"
+    # The shared config is not modified
+    assert source.raw["headers"]["Authorization"] == "Bearer {idToken}"
+
+
+def test_batch_needs_dependencies():
+    route = {
+        "id": "item",
+        "entity": "item",
+        "type": "DirectFetch",
+        "format": "json",
+        "batch": {"request": {"url": "/items", "params": {"ids": "{ids}"}}},
+    }
+    config = {
+        "id": "source",
+        "host": "host",
+        "routes": [route],
+        "entities": {"item": ["id"]},
+    }
+    try:
+        validate("source", config)
+    except SourceConfigError as err:
+        assert "batch needs dependencies" in str(err)
+    else:
+        raise AssertionError("batch without dependencies is valid")
+
+    route["dependencies"] = [{"entity": "list", "entity_key": "id", "key": "id"}]
+    validate("source", config)
+
+
+if __name__ == "__main__":
+    test_sources_are_valid()
+    test_frozen_tree_select()
+    test_compile_with_params()
+    test_batch_needs_dependencies()
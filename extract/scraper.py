@@ -1,21 +1,40 @@
+import copy
+import functools
 import json
 import logging
 import os
-from collections import defaultdict
-from datetime import datetime
+import sys
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timedelta
+from functools import cached_property
 
 import urllib3
 from loguru import logger
 
-from extract.parser import atom_parse, xml_parse
+from extract.cache import ResponseCache, request_key
+from extract.checkpoint import CheckpointWriter
+from extract.coalesce import RequestCoalescer
+from extract.expressions import compile_expression
+from extract.parser import atom_parse, json_stream, xml_parse, xml_stream
+from extract.registry import SourceConfig
 from extract.utils import (
     PropertyTree,
-    apply_nested,
+    Template,
+    compile_nested,
     deep_get,
-    dict_to_obj_tree,
-    partial_format,
+    render_nested,
 )
+from extract.ratelimit import (
+    LIMIT_STATUSES,
+    LimiterRegistry,
+    MemoryStore,
+    SqliteStore,
+)
+from extract.work_queue import WorkQueue
 from load.base import DataWarehouse
+from load.buffer import BufferedLoader
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 import urllib.parse
@@ -23,17 +42,17 @@ import urllib.parse
 import backoff
 import requests
 from dotenv import load_dotenv
-from requests_cache import CacheMixin
-from requests_cache.backends.filesystem import FileCache
-from requests_ratelimiter import LimiterMixin
 
 load_dotenv()
 logger = logging.getLogger("scaper")
 logger.setLevel(logging.DEBUG)
 
-logging.getLogger("requests_cache").setLevel("DEBUG")
-
 CACHE_DIR = os.environ["CACHE_DIR"]
+CACHE_MAX_SIZE = int(os.environ.get("CACHE_MAX_SIZE", 1024**3))  # bytes
+# sqlite file to share the rate limits between processes
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB")
+# seconds a response is shared with the other pipelines of a public source
+COALESCE_TTL = float(os.environ.get("COALESCE_TTL", 10))
 
 
 class NoResultException(Exception):
@@ -44,58 +63,139 @@ class EndOfPaginationException(Exception):
     pass
 
 
-class CachedLimiterSession(CacheMixin, LimiterMixin, requests.Session):
-    """Session class with caching and rate-limiting behavior. Accepts arguments for both
-    LimiterSession and CachedSession.
-    """
+class NotModifiedException(Exception):
+    """The response didn't change since it was cached (304)"""
 
+    def __init__(self, response):
+        self.response = response
+        super().__init__(response.url)
 
-class LimitedSession(LimiterMixin, requests.Session):
-    """Session class with caching and rate-limiting behavior. Accepts arguments for both
-    LimiterSession and CachedSession.
-    """
 
+class CrawlerException(Exception):
+    """Raised at the end of a run when some routes failed"""
 
-class FileCacheWithPostgres(FileCache):
-    def save_response(self, response, cache_key=None, expires=None):
-        logger.debug("cache_key", cache_key)
-        super().save_response(response, cache_key, expires)
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(
+            "\n".join(f"{route_id}: {err!r}" for route_id, err in errors.items())
+        )
 
 
-file_cache_backend = FileCacheWithPostgres(
-    cache_name=CACHE_DIR,
+# Shared by all the sessions of the process
+response_cache = ResponseCache(CACHE_DIR, max_size=CACHE_MAX_SIZE)
+limiters = LimiterRegistry(
+    SqliteStore(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryStore()
 )
+coalescer = RequestCoalescer(ttl=COALESCE_TTL)
 
 
-class CustomSession(LimitedSession):
+class CustomSession(requests.Session):
     """https://stackoverflow.com/a/51026159"""
 
-    def __init__(self, rate_limit=5, prefix_url=None, headers={}, *args, **kwargs):
-        super().__init__(
-            per_second=rate_limit,  # 100 requests per second max
-            cache_name=CACHE_DIR,
-            use_cache_dir=False,
-            backend=file_cache_backend,
-            serializer="json",
-            *args,
-            **kwargs,
-        )
+    def __init__(self, rate_limit=5, prefix_url=None, headers={}, coalesce=False):
+        super().__init__()
+        self.rate_limit = rate_limit  # requests per second, for each host
         self.prefix_url = prefix_url
         self.headers.update(headers)
+        self.cache = response_cache
+        self.cache_stats = defaultdict(int)
+        # Only for public sources: the request doesn't depend on the client
+        self.coalescer = coalescer if coalesce else None
 
     @backoff.on_exception(
         backoff.expo,
         requests.exceptions.RequestException,
         max_tries=5,
     )
-    def request(self, method, *args, **kwargs):
+    def request(self, method, *args, cache_ttl=None, **kwargs):
         if "params" in kwargs:
             # Avoid encoding
             # https://stackoverflow.com/a/23497912/2131871
             kwargs["params"] = urllib.parse.urlencode(kwargs["params"], safe=":+")
         print(method, self.prefix_url, args, kwargs)
         kwargs["url"] = self.prefix_url + kwargs["url"]  # urljoin(self.prefix_url, url)
-        return super(CustomSession, self).request(method, *args, **kwargs, verify=False)
+
+        if method.upper() != "GET" or kwargs.get("stream"):
+            return self._request(method, *args, **kwargs)
+        if self.coalescer is None:
+            return self._get(method, cache_ttl, *args, **kwargs)
+
+        key = request_key(
+            method,
+            kwargs["url"],
+            kwargs.get("params"),
+            None,
+            {**self.headers, **kwargs.get("headers", {})},
+        )
+        response, coalesced = self.coalescer.request(
+            key, lambda: self._get(method, cache_ttl, *args, **kwargs), owner=self
+        )
+        if coalesced:
+            self.cache_stats["coalesced"] += 1
+        return response
+
+    def _get(self, method, cache_ttl, *args, **kwargs):
+        if cache_ttl is None:
+            return self._request(method, *args, **kwargs)
+        return self._cached_request(method, cache_ttl, *args, **kwargs)
+
+    def _request(self, method, *args, **kwargs):
+        response = super(CustomSession, self).request(
+            method, *args, **kwargs, verify=False
+        )
+        if response.status_code in LIMIT_STATUSES:
+            # Retried by backoff, once the limiter allows it
+            raise requests.exceptions.HTTPError(
+                f"{response.status_code} rate limited: {response.url}",
+                response=response,
+            )
+        return response
+
+    def send(self, request, **kwargs):
+        limiter = limiters.get(request.url, self.rate_limit, self)
+        limiter.acquire()
+        response = super(CustomSession, self).send(request, **kwargs)
+        limiter.update(response)
+        return response
+
+    def close(self):
+        limiters.release(self)
+        super().close()
+
+    def _cached_request(self, method, ttl, *args, **kwargs):
+        """Serve fresh responses from the cache, revalidate the expired ones
+        with their ETag / Last-Modified. A 304 returns the cached response
+        with `not_modified = True`.
+        A new response is only cached by `response.cache_commit()`, once its
+        items are loaded: a 304 must never hide items that failed to load.
+        """
+        key = request_key(
+            method,
+            kwargs["url"],
+            kwargs.get("params"),
+            kwargs.get("json") or kwargs.get("data"),
+            {**self.headers, **kwargs.get("headers", {})},
+        )
+        cached = self.cache.get(key)
+        if cached and cached.is_fresh(ttl):
+            self.cache_stats["hit"] += 1
+            return cached.to_response()
+
+        if cached:
+            kwargs["headers"] = {**kwargs.get("headers", {}), **cached.validators}
+        response = self._request(method, *args, **kwargs)
+
+        if cached and response.status_code == 304:
+            self.cache_stats["not_modified"] += 1
+            response = cached.to_response()
+            response.not_modified = True
+            self.cache.set(key, response)  # fresh again for `ttl`
+            return response
+
+        self.cache_stats["miss"] += 1
+        if response.ok:
+            response.cache_commit = functools.partial(self.cache.set, key, response)
+        return response
 
 
 class File:
@@ -113,58 +213,144 @@ class File:
 
 
 class Crawler:
-    def __init__(self, config, debug=False, loader=lambda x: x, memory=File):
+    def __init__(
+        self, config, debug=False, loader=lambda x: x, memory=File, coalesce=False
+    ):
         self.debug = debug
         self.config = config
         self.session = CustomSession(
             rate_limit=config.select("rate_limit", 20),
-            crawler=self,
             prefix_url=config.host,
             headers=config.select("headers", {}),
+            coalesce=coalesce,
         )
         self.retrievers = [
             type2class(entity.type)(self, entity) for entity in self.config.routes
         ]
         self.loader = loader
         self.memory = memory
+        self.params = config.params.dict() if hasattr(config, "params") else {}
+        self.checkpoint = CheckpointWriter(
+            memory,
+            interval=config.select("checkpoint.interval", 30),
+            pages=config.select("checkpoint.pages", 50),
+        )
+        # Dependent routes are run by the queue, loader and memory are shared
+        self.queue = WorkQueue(max_workers=config.select("dependency_concurrency", 4))
+        self.lock = threading.RLock()
         logger.debug(f"crawler host: {config.host}")
 
     def run(self):
         logger.info(f"Start crawling {self.config.id}")
-        # Take all routes from config and run them
-
-        for retriever in self.retrievers:
-            retriever.start()
+        # Take all routes from config and run them, independently of each other
+        errors = {}
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.config.select("route_concurrency", 4)
+            ) as executor:
+                futures = {
+                    executor.submit(retriever.start): retriever.config.id
+                    for retriever in self.retrievers
+                }
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as err:
+                        logger.error(f"Route {futures[future]} failed: {err!r}")
+                        errors[futures[future]] = err
+
+            # Wait for the dependent routes, then send their last partial batches
+            while True:
+                for (route_id, _), err in self.queue.join():
+                    logger.error(f"Route {route_id} failed: {err!r}")
+                    errors.setdefault(route_id, err)
+                if not any(
+                    [retriever.flush_batches() for retriever in self.retrievers]
+                ):
+                    break
+        finally:
+            self.queue.close()
+            self.session.close()
+            try:
+                # The last states are saved once their items are loaded
+                if hasattr(self.loader, "join"):
+                    self.loader.join()
+            finally:
+                failed = bool(errors) or sys.exc_info()[0] is not None
+                self._flush_checkpoint(failed)
+                logger.info(f"Cache {self.config.id}: {dict(self.session.cache_stats)}")
+
+        if errors:
+            raise CrawlerException(errors)
+
+    def _flush_checkpoint(self, failed):
+        """Write the last states. When the run already failed, an error here is
+        only logged, so that it doesn't replace the error of the run.
+        """
+        try:
+            self.checkpoint.flush()
+        except Exception as err:
+            if not failed:
+                raise
+            logger.error(f"Checkpoint of {self.config.id} failed: {err!r}")
 
     def _fetch(self, method, **attributes):
         try:
             logger.info(method, attributes)
-
-            if hasattr(self.config, "params"):
-                # Iterate on nested dict and format
-                attributes = apply_nested(
-                    attributes,
-                    lambda x: partial_format(x, **self.config.params.dict()),
-                )
-
             response = self.session.request(method, **attributes)
             response.raise_for_status()
         except Exception as err:
             logger.error(err)
-            logger.error(err.response)
+            logger.error(getattr(err, "response", None))
             raise
         return response
 
     def export_item(self, entity, item):
-        self.loader.load(self.config.id, entity, item)
+        with self.lock:
+            self.loader.load(self.config.id, entity, item)
 
-    def add_items(self, entity, items):
-        self.loader.load(self.config.id, entity, items)
+    def on_loaded(self, callback):
+        """Call `callback` once the items added so far are loaded"""
+        if hasattr(self.loader, "on_loaded"):
+            self.loader.on_loaded(callback)
+        else:
+            callback()  # Loaded synchronously
+
+    def add_items(self, entity, items, commits=()):
+        """Load the items, then cache the responses they come from (`commits`)"""
+        with self.lock:
+            if items:
+                self.loader.load(self.config.id, entity, items)
+            for commit in commits:
+                if commit is not None:
+                    self.on_loaded(commit)
         for item in items:
             for retriever in self.retrievers:
                 retriever.check_item(entity, item)
 
 
+def ordered_map(func, iterable, concurrency=1):
+    """Like `map`, with up to `concurrency` calls running in threads.
+    Results are yielded in the order of `iterable`.
+    """
+    if concurrency <= 1:
+        yield from map(func, iterable)
+        return
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = deque()
+        try:
+            for value in iterable:
+                futures.append(executor.submit(func, value))
+                if len(futures) >= concurrency:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
 # Create class retriever / route design / ... ?
 class Strategy:
     def __init__(self, crawler, config):
@@ -172,6 +358,10 @@ class Strategy:
         self.config = config  # config could be just the name ?
         self.params = {}  # custom params
         self.state = {}
+        # Params of the dependent items waiting for a batch request
+        self.batches = defaultdict(list)
+        self.batch_seen = set()
+        self.batch_lock = threading.Lock()
 
     def start(self):
         self.load_state()
@@ -183,7 +373,14 @@ class Strategy:
         raise NotImplementedError
 
     def save_state(self):
-        self.crawler.memory.save_state(self.config.id, self.state)
+        if hasattr(self.config, "dependencies"):
+            # Run once per parent item, there is no single state to resume from
+            return
+        # Only once the items fetched before are loaded, or they would be skipped
+        state = copy.deepcopy(self.state)
+        self.crawler.on_loaded(
+            functools.partial(self.crawler.checkpoint.save, self.config.id, state)
+        )
 
     def load_state(self):
         self.state = self.crawler.memory.load_state(self.config.id)
@@ -191,112 +388,344 @@ class Strategy:
     def check_item(self, entity, item):
         for dep in getattr(self.config, "dependencies", []):
             if dep.entity == entity:
-                value = item[dep.entity_key]
-                key = dep.key
-
-                # if key in self.config.params:
-                #     pass
-                self.params[key] = value
-
-                self._start()
-
-    def add_items(self, items):
+                params = {**self.params, dep.key: item[dep.entity_key]}
+                # Identical params are only fetched once per run
+                key = (self.config.id, json.dumps(params, sort_keys=True, default=str))
+                if self.batch is not None:
+                    self._add_to_batch(key, params, dep.key)
+                else:
+                    self.crawler.queue.submit(key, self._start_with_params, params)
+
+    def _start_with_params(self, params):
+        """Run the route for one parent item, on its own copy of the strategy"""
+        strategy = copy.copy(self)
+        strategy.params = params
+        strategy.state = {}
+        return strategy._start()
+
+    def add_items(self, items, commits=()):
         for item in items:
             item.update(self.params)
-        self.crawler.add_items(self.config.entity, items)
+        self.crawler.add_items(self.config.entity, items, commits)
+
+    @property
+    def batch(self):
+        return getattr(self.config, "batch", None)
+
+    @cached_property
+    def batch_template(self):
+        """The request of a batch of ids, parsed once"""
+        return compile_nested(self.batch.request.dict())
+
+    def _add_to_batch(self, key, params, name):
+        """Buffer the params of a dependent item, submit them by `batch.size`.
+        Items are grouped by their other params (eg: of a parent route).
+        """
+        group = (name, json.dumps({**params, name: None}, sort_keys=True, default=str))
+        with self.batch_lock:
+            if key in self.batch_seen:
+                return
+            self.batch_seen.add(key)
+            self.batches[group].append(params)
+            if len(self.batches[group]) < getattr(self.batch, "size", 100):
+                return
+            params_list = self.batches.pop(group)
+        self._submit_batch(name, params_list)
+
+    def _submit_batch(self, name, params_list):
+        key = (self.config.id, json.dumps([p[name] for p in params_list], default=str))
+        self.crawler.queue.submit(key, self._start_batch, name, params_list)
+
+    def flush_batches(self):
+        """Submit the partial batches, return True if there was any"""
+        with self.batch_lock:
+            batches, self.batches = self.batches, defaultdict(list)
+        for (name, _), params_list in batches.items():
+            self._submit_batch(name, params_list)
+        return bool(batches)
+
+    def _start_batch(self, name, params_list):
+        """Fetch the dependent items by batches, with the params of each item"""
+        params_by_id = {str(params[name]): params for params in params_list}
+        common = {k: v for k, v in params_list[0].items() if k != name}
+        for ids in self._batches(list(params_by_id), common):
+            items, commit = self._fetch_batch(ids, common)
+            found = []
+            for id in ids:
+                if id in items:
+                    found.append({**items[id], **params_by_id[id]})
+            self.crawler.add_items(self.config.entity, found, [commit])
+
+    def _batch_url_length(self, params):
+        attributes = self._render(self.batch_template, {**params, "ids": ""})
+        request = requests.Request(
+            "GET",
+            self.crawler.config.host + attributes.get("url", ""),
+            params=attributes.get("params"),
+        )
+        return len(request.prepare().url)
+
+    def _batches(self, ids, params=None):
+        """Split the ids by `batch.size`, and so that urls fit in `max_url_length`"""
+        size = getattr(self.batch, "size", 100)
+        max_length = getattr(self.batch, "max_url_length", 2000)
+        separator = urllib.parse.quote(getattr(self.batch, "separator", ","))
+        base_length = self._batch_url_length(params or {})
+
+        batch, length = [], base_length
+        for id in ids:
+            id_length = len(urllib.parse.quote(str(id))) + len(separator)
+            if batch and (len(batch) >= size or length + id_length > max_length):
+                yield batch
+                batch, length = [], base_length
+            batch.append(id)
+            length += id_length
+        if batch:
+            yield batch
+
+    def _fetch_batch(self, ids, params=None):
+        """Fetch a batch of ids, return the items by id (as str) and the
+        commit of the response (see `_fetch`)"""
+        separator = getattr(self.batch, "separator", ",")
+        attributes = self._render(
+            self.batch_template,
+            {**(params or {}), "ids": separator.join(str(id) for id in ids)},
+        )
+        try:
+            response, commit = self._fetch(**attributes)
+        except NotModifiedException:
+            return {}, None  # Already loaded
+
+        key = getattr(self.batch, "key", None)
+        results = deep_get(response, key) if key else response
+        if isinstance(results, dict):  # Items by id
+            items = {str(id): item for id, item in results.items() if item is not None}
+        else:
+            id_key = getattr(self.batch, "id", "id")
+            items = {
+                str(deep_get(item, id_key)): item
+                for item in results
+                if item is not None
+            }
+        return items, commit
+
+    @cached_property
+    def request_template(self):
+        """The request of the route, parsed once"""
+        return compile_nested(getattr(self.config, "request", PropertyTree()).dict())
+
+    def _render(self, template, params=None):
+        """Format the params of the route and of the source (a new dict)"""
+        return render_nested(
+            template, {**self.crawler.params, **self.params, **(params or {})}
+        )
 
-    def _fetch(self, **attributes):
+    def _request_attributes(self, params=None):
+        return self._render(self.request_template, params)
+
+    def _request(self, **attributes):
         method = getattr(
             self.config, "method", "GET"
         )  # TO HAVE IT EXPLICITELY IN CONFIG
-        # Iterate on nested dict and format
-        attributes = apply_nested(
-            attributes,
-            lambda x: partial_format(x, **self.params),
-        )
-        response = self.crawler._fetch(method, **attributes)
+        if hasattr(self.config, "cache"):
+            attributes["cache_ttl"] = getattr(self.config.cache, "ttl", 0)
+        return self.crawler._fetch(method, **attributes)
 
+    def _fetch(self, **attributes):
+        """Fetch and parse, raise NotModifiedException on 304.
+        Also return the commit caching the response, to give to `add_items`
+        with its items (None when the route isn't cached).
+        """
+        response = self._request(**attributes)
+        if getattr(response, "not_modified", False):
+            raise NotModifiedException(response)
+        return self._parse(response), getattr(response, "cache_commit", None)
+
+    def _parse(self, response):
         if self.config.format == "atom:1.0":  # should be moved ?
             return atom_parse(response.text)
         if self.config.format == "xml":
             return xml_parse(response.text)
         return response.json()
 
+    @property
+    def stream(self):
+        return getattr(self.config, "stream", False)
+
+    def _load_stream(self, **attributes):
+        """Add the items under `key` by batches, parsing the response
+        incrementally instead of loading it in memory.
+        For xml, `key` is the path of the elements (eg: 'feed.entry').
+        Return the number of items.
+        """
+        count = 0
+
+        def add_items(items):
+            nonlocal count
+            self.add_items(items)
+            count += len(items)
+
+        batch_size = getattr(self.config, "batch_size", 1000)
+        response = self._request(stream=True, **attributes)
+        response.raw.decode_content = True  # gzip, deflate...
+        with response:
+            if self.config.format in ("xml", "atom:1.0"):
+                xml_stream(response.raw, self.config.key, add_items, batch_size)
+            elif self.config.format == "json":
+                for items in json_stream(response.raw, self.config.key, batch_size):
+                    add_items(items)
+            else:
+                raise NotImplementedError(f"Can't stream {self.config.format}")
+        return count
+
 
 class Looping(Strategy):
-    max_value = None  # To Save and update ?
+    """Fetch items one id at a time, up to `max_value`
+    The last fetched id is saved in the state, so a run only fetches the new ids
+    (and the `recheck` last ones, for items that may have changed since).
+    """
 
     def start(self):
+        self.load_state()
         max_value = self._fetch_max_value()
-        logger.debug(f"max_value: {max_value}")  # TODO: to save
-        for ind, value in enumerate(range(max_value, 0, -1)):
-            if self.crawler.debug and ind > 3:
-                break
-            # Safety measure: stop if too many requests
-            if ind > 1000:
-                raise Exception("Too many requests")
-            url = self.config.request.url.format(value)
-            result = self._fetch(url=url)
+        logger.debug(f"max_value: {max_value}")
 
-            self.add_items([result])
+        # Safety measure: stop if too many requests
+        max_requests = 4 if self.crawler.debug else self.max_requests
+
+        last_value = self.state.get("max_value")
+        if last_value is None:
+            # First run, only fetch the latest items
+            first_value = max_value - max_requests + 1
+        else:
+            first_value = last_value - getattr(self.config, "recheck", 0) + 1
+
+        values = range(max(first_value, 1), max_value + 1)
+        if len(values) > max_requests:
+            logger.warning(f"Stop after {max_requests} requests")
+            values = values[:max_requests]
+
+        batch_size = getattr(self.config, "batch_size", self.concurrency)
+        batch, commits = [], []
+        for value, result, commit in self._fetch_values(values):
+            if result is not None:  # HN sent null some times
+                batch.append(result)
+            commits.append(commit)
+            if len(batch) >= batch_size or value == values[-1]:
+                self.add_items(batch, commits)
+                batch, commits = [], []
+                self.state["max_value"] = value
+                self.save_state()
+
+    @property
+    def concurrency(self):
+        return getattr(self.config, "concurrency", 1)
+
+    @property
+    def max_requests(self):
+        return getattr(self.config, "max_requests", 1000)
+
+    def _fetch_values(self, values):
+        """Yield (value, item, commit) in the order of `values`"""
+        if self.batch is None:
+            results = ordered_map(self._fetch_item, values, self.concurrency)
+            for value, (item, commit) in zip(values, results):
+                yield value, item, commit
+            return
+
+        batches = list(self._batches(values))
+        results = ordered_map(self._fetch_batch, batches, self.concurrency)
+        for ids, (items, commit) in zip(batches, results):
+            for value in ids:
+                # The response is cached with the items of its last id
+                yield value, items.get(str(value)), commit if value == ids[-1] else None
+
+    def _fetch_item(self, value):
+        try:
+            return self._fetch(**self._request_attributes({"0": value}))
+        except NotModifiedException:
+            return None, None  # Already loaded
 
     def _fetch_value(self, data, path):
         """TODO"""
         return data
 
     def _fetch_max_value(self):
-        res = self._fetch(url=self.config.max_value.url)
+        url = self._render(Template(self.config.max_value.url))
+        try:
+            res, commit = self._fetch(url=url)
+            if commit is not None:
+                commit()  # No item to load
+        except NotModifiedException as err:
+            res = self._parse(err.response)
         value = self._fetch_value(res, self.config.max_value.key_path)
         return value
 
 
 class DirectFetch(Strategy):
     def _start(self):
-        url = self.config.request.url
-        result = self._fetch(url=url)
-        self.add_items([result])
+        try:
+            result, commit = self._fetch(**self._request_attributes())
+        except NotModifiedException:
+            return  # Already loaded
+        self.add_items([result], [commit])
 
 
 class List(Strategy):
     """Listing without pagination"""
 
     def _start(self):
-        response = self._fetch(url=self.config.request.url)
+        if self.stream:
+            self._load_stream(**self._request_attributes())
+            return
+
+        try:
+            response, commit = self._fetch(**self._request_attributes())
+        except NotModifiedException:
+            return  # Already loaded
         results = deep_get(response, self.config.key)
-        self.add_items(results)
+        self.add_items(results, [commit])
 
 
 class Listing(Strategy):
     """Listing with pagination"""
 
-    @backoff.on_exception(
-        backoff.expo,
-        NoResultException,
-        max_tries=3,
-    )
-    def _fetch_list(self, cursor=None):
-        request_attributes = getattr(self.config, "request", PropertyTree()).dict()
+    def _render_params(self, cursor=None):
+        return {} if cursor is None else {"cursor": cursor}
+
+    def _page_attributes(self, cursor=None):
+        request_attributes = self._request_attributes(self._render_params(cursor))
         if hasattr(self.config, "pagination") and cursor is not None:  # if pagination
             type = self.config.pagination.type
             if type not in request_attributes:
                 request_attributes[type] = {self.config.pagination.key: cursor}
             if isinstance(request_attributes[type], dict):
                 request_attributes[type][self.config.pagination.key] = cursor
-            elif isinstance(request_attributes[type], str):
-                request_attributes[type] = request_attributes[type].format(
-                    cursor=cursor
-                )
-            else:
+            elif not isinstance(request_attributes[type], str):  # {cursor} rendered
                 raise Exception('Request params should be "dict" or "str"')
+        return request_attributes
 
-        response = self._fetch(**request_attributes)
+    def _fetch_page(self, cursor=None):
+        commit = None
+        try:
+            response, commit = self._fetch(**self._page_attributes(cursor))
+            loaded = False
+        except NotModifiedException as err:
+            # Already loaded, only parsed for the pagination
+            response = self._parse(err.response)
+            loaded = True
         results = deep_get(response, self.config.key)
-        self.add_items(results)
+        return response, results, loaded, commit
+
+    def _process_page(self, cursor, response, results, loaded=False, commit=None):
+        if not loaded:
+            self.add_items(results, [commit])
 
+        variables = {"response": response, "results": results, "cursor": cursor}
         if hasattr(self.config.pagination, "stop_func"):
-            logger.debug(f"evaluate with stop func: {self.config.pagination.stop_func}")
-            # TODO: should probably wrap in its own function to enforce params
-            should_stop = eval(self.config.pagination.stop_func)
+            should_stop = compile_expression(self.config.pagination.stop_func)(
+                **variables
+            )
             logger.debug(f"should_stop: {should_stop}")
             if should_stop:
                 raise EndOfPaginationException()
@@ -305,7 +734,7 @@ class Listing(Strategy):
             raise NoResultException("No results")
 
         if hasattr(self.config.pagination, "ref_func"):
-            cursor = eval(self.config.pagination.ref_func)
+            cursor = compile_expression(self.config.pagination.ref_func)(**variables)
         elif hasattr(self.config.pagination, "ref"):
             cursor = deep_get(response, self.config.pagination.ref)
         elif hasattr(self.config.pagination, "step"):
@@ -315,11 +744,46 @@ class Listing(Strategy):
 
         return cursor
 
+    def _stream_page(self, cursor=None):
+        """Load the page by batches, the cursor can't depend on the response"""
+        pagination = self.config.pagination
+        if any(hasattr(pagination, k) for k in ("ref", "ref_func", "stop_func")):
+            raise NotImplementedError("Can't stream a response used for pagination")
+
+        count = self._load_stream(**self._page_attributes(cursor))
+        if not count:
+            raise NoResultException("No results")
+        return cursor + getattr(pagination, "step", count)
+
+    @backoff.on_exception(
+        backoff.expo,
+        NoResultException,
+        max_tries=3,
+    )
+    def _fetch_list(self, cursor=None):
+        if self.stream:
+            return self._stream_page(cursor)
+        return self._process_page(cursor, *self._fetch_page(cursor))
+
+    def _can_prefetch(self, cursor):
+        """The next cursor can be computed without the current response"""
+        pagination = getattr(self.config, "pagination", None)
+        return (
+            pagination is not None
+            and isinstance(cursor, int)
+            and not hasattr(pagination, "ref")
+            and not hasattr(pagination, "ref_func")
+        )
+
     def _start(self):
         cursor = self.state.get("cursor") or getattr(
             self.config.pagination, "default", None
         )
 
+        concurrency = getattr(self.config, "concurrency", 1)
+        if concurrency > 1 and not self.stream and self._can_prefetch(cursor):
+            return self._start_concurrent(cursor, concurrency)
+
         # Safety measure: we don't want to loop forever
         ind = -1
         while True:
@@ -339,30 +803,234 @@ class Listing(Strategy):
             if not cursor:
                 break
 
+    def _process_prefetched(self, cursor, future):
+        """An empty page is fetched again with the backoff of `_fetch_list`,
+        as in the sequential pagination, before ending the pagination"""
+        try:
+            return self._process_page(cursor, *future.result())
+        except NoResultException:
+            return self._fetch_list(cursor)
+
+    def _start_concurrent(self, cursor, concurrency):
+        """Keep `concurrency` pages in flight.
+        Cursors are computed in advance with `pagination.step`, or with the size
+        of the first page. Pages are processed in cursor order, so the saved
+        cursor is always the one following the last loaded page.
+        """
+        step = getattr(self.config.pagination, "step", None)
+        if step is None:
+            # Page size is only known once we have fetched the first page
+            try:
+                next_cursor = self._fetch_list(cursor)
+            except (NoResultException, EndOfPaginationException):
+                return
+            step = next_cursor - cursor
+            cursor = next_cursor
+            self.state["cursor"] = cursor
+            self.save_state()
+
+        pages = deque()
+        next_cursor = cursor
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+            def prefetch():
+                nonlocal next_cursor
+                future = executor.submit(self._fetch_page, next_cursor)
+                pages.append((next_cursor, future))
+                next_cursor += step
+
+            for _ in range(concurrency):
+                prefetch()
+
+            ind = -1
+            while pages:
+                ind += 1
+                page_cursor, future = pages.popleft()
+
+                try:
+                    cursor = self._process_prefetched(page_cursor, future)
+                except (NoResultException, EndOfPaginationException):
+                    break
+
+                self.state["cursor"] = cursor
+                self.save_state()
+
+                if self.crawler.debug and ind >= 3:
+                    break
+
+                prefetch()
+
+            # Pages after the end of the pagination are never loaded
+            for _, future in pages:
+                future.cancel()
+
 
 class Slicing(Listing):
-    """Slice with date"""
+    """Slice with date
+
+    Without `slice.window_days`, the whole range is fetched as one window.
+    Otherwise, the range from `slice.start` to today is split in windows of
+    `window_days`, fetched `slice.concurrency` at a time. A window reaching
+    `slice.max_results` is split in two and fetched again, and the next windows
+    are halved; after a sparse window, they are doubled.
+    Unfinished windows are saved in `state.windows` and resumed first.
+    """
 
     from_date = datetime(1900, 1, 1)
     to_date = datetime(9999, 12, 31)  # datetime.now()
+    window_format = "%Y-%m-%d"
+    count = 0  # Results of the window
 
     def format_date(self, date):
         return date.strftime(self.config.slice.date_format)
 
-    def _start(self):
-        request_attributes = getattr(self.config, "request", PropertyTree()).dict()
-        params = self.config.slice
-        if isinstance(request_attributes[params.type], str):
-            request_attributes[params.type] = partial_format(
-                request_attributes[params.type],
-                from_date=self.format_date(self.from_date),
-                to_date=self.format_date(self.to_date),
-            )
-            self.config.request = dict_to_obj_tree(request_attributes)
-        else:
+    def _render_params(self, cursor=None):
+        if not isinstance(self.request_template[self.config.slice.type], Template):
             raise Exception('Request params should be "dict" or "str"')
+        return {
+            **super(Slicing, self)._render_params(cursor),
+            "from_date": self.format_date(self.from_date),
+            "to_date": self.format_date(self.to_date),
+        }
+
+    def _process_page(self, cursor, response, results, loaded=False, commit=None):
+        self.count += len(results or [])
+        return super()._process_page(cursor, response, results, loaded, commit)
+
+    def _load_stream(self, **attributes):
+        count = super()._load_stream(**attributes)
+        self.count += count
+        return count
+
+    def _window_key(self, from_date, to_date):
+        return "/".join(d.strftime(self.window_format) for d in (from_date, to_date))
+
+    def _parse_window_key(self, key):
+        return [datetime.strptime(d, self.window_format) for d in key.split("/")]
+
+    def _window(self, key):
+        """Copy of the strategy fetching one window, with its own cursor"""
+        window = copy.copy(self)
+        window.window_key = key
+        window.from_date, window.to_date = self._parse_window_key(key)
+        window.state = dict(self.state["windows"][key])
+        window.count = window.state.pop("count", 0)
+        return window
+
+    def _fetch_window(self):
+        super()._start()
+        return self.count
 
-        return super(Slicing, self)._start()
+    def save_state(self):
+        key = getattr(self, "window_key", None)
+        if key is None:
+            return super().save_state()
+        # A window: its cursor is saved in the state of the route
+        route = self.route
+        with route.windows_lock:
+            route.state["windows"][key] = {**self.state, "count": self.count}
+            route.save_state()
+
+    def _add_window(self, from_date, to_date):
+        key = self._window_key(from_date, to_date)
+        self.state["windows"][key] = {}
+        return key
+
+    def _end_window(self, window, days, end):
+        """Remove the window from the state, return the size of the next ones.
+        Without `max_results`, a full window can't be detected: the windows are
+        only doubled after an empty one, and never halved.
+        """
+        slice = self.config.slice
+        max_results = getattr(slice, "max_results", None)
+        from_date, to_date = window.from_date, window.to_date
+        logger.debug(f"window {window.window_key}: {window.count} results")
+
+        del self.state["windows"][window.window_key]
+        if max_results and window.count >= max_results:
+            days = max(days // 2, 1)
+            if to_date > from_date:
+                # Results were cut, fetch each half again
+                middle = from_date + timedelta(days=(to_date - from_date).days // 2)
+                self._add_window(from_date, middle)
+                self._add_window(middle + timedelta(days=1), to_date)
+            else:
+                logger.warning(f"window {window.window_key} reached max_results")
+        elif max_results:
+            if window.count < max_results / 4:
+                days *= 2  # Sparse
+        elif not window.count:
+            days *= 2  # Empty
+
+        if to_date >= end:
+            # Today isn't over, fetch it again on the next run
+            self.state["next"] = from_date.strftime(self.window_format)
+        return days
+
+    def _start(self):
+        slice = self.config.slice
+        days = getattr(slice, "window_days", None)
+        if days is None:
+            return super()._start()
+
+        concurrency = getattr(slice, "concurrency", 1)
+        end = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = getattr(slice, "start", self.from_date.strftime(self.window_format))
+        next_date = datetime.strptime(self.state.get("next", start), self.window_format)
+
+        self.route = self
+        self.windows_lock = threading.Lock()
+        self.state.setdefault("windows", {})
+        running = {}  # future -> window
+        submitted = 0
+        error = None
+
+        def next_window():
+            """Key of an unfinished window (resumed first), or of a new one"""
+            nonlocal next_date
+            fetching = {window.window_key for window in running.values()}
+            for key in self.state["windows"]:
+                if key not in fetching:
+                    return key
+            if next_date > end:
+                return None
+            to_date = min(next_date + timedelta(days=days - 1), end)
+            key = self._add_window(next_date, to_date)
+            next_date = to_date + timedelta(days=1)
+            self.state["next"] = next_date.strftime(self.window_format)
+            return key
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                while len(running) < concurrency and error is None:
+                    if self.crawler.debug and submitted >= 2:
+                        break
+                    with self.windows_lock:
+                        key = next_window()
+                    if key is None:
+                        break
+                    window = self._window(key)
+                    running[executor.submit(window._fetch_window)] = window
+                    submitted += 1
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as err:
+                        # Let the other windows finish, this one stays in the state
+                        error = err
+                        continue
+                    with self.windows_lock:
+                        days = self._end_window(window, days, end)
+                        self.save_state()
+
+        if error is not None:
+            raise error
 
 
 def type2class(type):
@@ -380,13 +1048,16 @@ def type2class(type):
         raise NotImplementedError
 
 
-def runner(config: dict, target: str, debug=False, memory=File(), params={}):
-    if params:
-        config = apply_nested(
-            config,
-            lambda x: partial_format(x, **params),
+def runner(source: SourceConfig, target: str, debug=False, memory=File(), params={}):
+    config_tree = source.compile(params)
+    # Load in the background, while the crawler keeps fetching
+    with BufferedLoader(DataWarehouse(target)) as loader:
+        crawler = Crawler(
+            config_tree,
+            debug=debug,
+            memory=memory,
+            loader=loader,
+            coalesce=not params,  # Same requests for all the pipelines
         )
-    loader = DataWarehouse(target)
-    config_tree = dict_to_obj_tree(config)
-    crawler = Crawler(config_tree, debug=debug, memory=memory, loader=loader)
-    crawler.run()
+        crawler.run()
+    return dict(crawler.session.cache_stats)
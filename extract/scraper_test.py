@@ -0,0 +1,281 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp())
+
+from extract.registry import FrozenTree
+from extract.scraper import Crawler, CrawlerException, ordered_map
+from load.buffer import BufferedLoader
+
+
+class Response:
+    url = "http://host"
+
+    def __init__(self, data, status_code=200, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.text = json.dumps(data)
+        self.content = self.text.encode()
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+
+class Loader:
+    def __init__(self):
+        self.items = []
+
+    def load(self, source_id, entity, items):
+        self.items += items
+
+
+class Memory:
+    def __init__(self):
+        self.states = {}
+
+    def save_state(self, id, state):
+        self.states[id] = state
+
+    def load_state(self, id):
+        return dict(self.states.get(id, {}))
+
+
+def crawler(config, request):
+    loader, memory = Loader(), Memory()
+    crawler = Crawler(FrozenTree(config), loader=loader, memory=memory)
+    crawler.session.request = request
+    return crawler, loader, memory
+
+
+def test_ordered_map_order_and_concurrency():
+    lock = threading.Lock()
+    running, max_running = 0, 0
+
+    def func(value):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01 * (value % 3))  # finish out of order
+        with lock:
+            running -= 1
+        return value * 2
+
+    assert list(ordered_map(func, range(20), concurrency=4)) == [
+        value * 2 for value in range(20)
+    ]
+    assert 1 < max_running <= 4
+
+
+def test_concurrent_listing_retries_empty_pages():
+    fetched = []
+
+    def request(method, url, **kwargs):
+        cursor = int(url.split("/")[-1])
+        fetched.append(cursor)
+        if cursor >= 10 or fetched.count(cursor) == 1 and cursor == 4:
+            return Response({"items": []})  # page 4 is empty the first time
+        return Response({"items": [{"id": cursor}, {"id": cursor + 1}]})
+
+    config = {
+        "id": "source",
+        "host": "host",
+        "routes": [
+            {
+                "id": "list",
+                "entity": "item",
+                "type": "Listing",
+                "format": "json",
+                "key": "items",
+                "concurrency": 3,
+                "request": {"url": "/items/{cursor}"},
+                "pagination": {"default": 0, "key": "cursor", "type": "url"},
+            }
+        ],
+    }
+    crawl, loader, memory = crawler(config, request)
+    crawl.run()
+    assert [item["id"] for item in loader.items] == list(range(10))
+    assert memory.states["list"]["cursor"] == 10
+
+
+def test_coalesced_listing_retries_empty_pages():
+    fetched = []
+    prefix = f"/items/{time.time()}"
+
+    def request(method, url, **kwargs):
+        cursor = int(url.split("/")[-1])
+        fetched.append(cursor)
+        if cursor >= 4 or fetched.count(cursor) == 1 and cursor == 2:
+            return Response({"items": []})  # page 2 is empty the first time
+        return Response({"items": [{"id": cursor}, {"id": cursor + 1}]})
+
+    config = {
+        "id": "source",
+        "host": "host",
+        "routes": [
+            {
+                "id": "list",
+                "entity": "item",
+                "type": "Listing",
+                "format": "json",
+                "key": "items",
+                "request": {"url": prefix + "/{cursor}"},
+                "pagination": {"default": 0, "key": "cursor", "type": "url"},
+            }
+        ],
+    }
+    loader = Loader()
+    crawl = Crawler(FrozenTree(config), loader=loader, memory=Memory(), coalesce=True)
+    crawl.session._request = request
+    crawl.run()
+    assert [item["id"] for item in loader.items] == list(range(4))
+    assert crawl.session.cache_stats["coalesced"] == 0
+
+
+def test_cache_response_once_loaded():
+    config = {
+        "id": "cached",
+        "host": "host",
+        "routes": [
+            {
+                "id": "list",
+                "entity": "item",
+                "type": "List",
+                "format": "json",
+                "key": "items",
+                "cache": {"ttl": 0},
+                "request": {"url": f"/items/{time.time()}"},
+            }
+        ],
+    }
+    validators = []
+
+    def request(method, **kwargs):
+        validators.append(kwargs.get("headers", {}).get("If-None-Match"))
+        if validators[-1] == "v1":
+            return Response(None, status_code=304)
+        return Response({"items": [{"id": 1}]}, headers={"ETag": "v1"})
+
+    class FailingLoader:
+        def load(self, source_id, entity, items):
+            raise ValueError("Can't load")
+
+    def run(loader):
+        crawl = Crawler(FrozenTree(config), loader=loader, memory=Memory())
+        crawl.session._request = request
+        crawl.run()
+
+    buffered = BufferedLoader(FailingLoader())
+    try:
+        run(buffered)
+    except ValueError:
+        pass
+    buffered.close(raise_error=False)
+
+    # Not cached: fetched and loaded again
+    loader = Loader()
+    run(loader)
+    assert validators == [None, None]
+    assert loader.items == [{"id": 1}]
+
+    # Cached once loaded: 304, nothing to load
+    loader = Loader()
+    run(loader)
+    assert validators == [None, None, "v1"]
+    assert loader.items == []
+
+
+def test_checkpoint_once_loaded():
+    def request(method, url, **kwargs):
+        cursor = int(url.split("/")[-1])
+        items = [{"id": cursor}, {"id": cursor + 1}] if cursor < 20 else []
+        return Response({"items": items})
+
+    class FailingLoader(Loader):
+        def load(self, source_id, entity, items):
+            if items[0]["id"] >= 6:
+                raise ValueError("Can't load")
+            super().load(source_id, entity, items)
+
+    config = {
+        "id": "source",
+        "host": "host",
+        "routes": [
+            {
+                "id": "list",
+                "entity": "item",
+                "type": "Listing",
+                "format": "json",
+                "key": "items",
+                "request": {"url": "/items/{cursor}"},
+                "pagination": {"default": 0, "key": "cursor", "type": "url"},
+            }
+        ],
+    }
+    loader = FailingLoader()
+    buffered = BufferedLoader(loader, max_rows=2)
+    crawl, _, memory = crawler(config, request)
+    crawl.loader = buffered
+    try:
+        crawl.run()
+    except Exception:
+        pass
+    buffered.close(raise_error=False)
+    assert [item["id"] for item in loader.items] == list(range(6))
+    # The cursor of the first page that failed to load
+    assert memory.states["list"]["cursor"] == 6
+
+
+def test_checkpoint_error_keeps_route_error():
+    def request(method, url, **kwargs):
+        if url.endswith("/2"):
+            raise ValueError("Route error")
+        return Response({"items": [{"id": 1}]})
+
+    class FailingMemory(Memory):
+        def save_state(self, id, state):
+            raise ValueError("Checkpoint error")
+
+    config = {
+        "id": "source",
+        "host": "host",
+        "routes": [
+            {
+                "id": "list",
+                "entity": "item",
+                "type": "Listing",
+                "format": "json",
+                "key": "items",
+                "request": {"url": "/items/{cursor}"},
+                "pagination": {"default": 1, "key": "cursor", "type": "url"},
+            }
+        ],
+    }
+    crawl = Crawler(FrozenTree(config), loader=Loader(), memory=FailingMemory())
+    crawl.session.request = request
+    try:
+        crawl.run()
+    except CrawlerException as err:
+        assert "Route error" in repr(err)
+    else:
+        raise AssertionError("The run didn't fail")
+
+
+if __name__ == "__main__":
+    test_ordered_map_order_and_concurrency()
+    test_concurrent_listing_retries_empty_pages()
+    test_coalesced_listing_retries_empty_pages()
+    test_cache_response_once_loaded()
+    test_checkpoint_once_loaded()
+    test_checkpoint_error_keeps_route_error()
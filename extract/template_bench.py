@@ -0,0 +1,57 @@
+# Microbenchmark: formatting the request of each page of a crawl
+# python extract/template_bench.py
+import os
+import sys
+import timeit
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.registry import FrozenTree
+from extract.utils import apply_nested, compile_nested, partial_format, render_nested
+
+PAGES = 10000
+
+request = FrozenTree(
+    {
+        "url": "/{baseId}/{tableName}/records/{cursor}",
+        "params": {
+            "page_size": 100,
+            "view": "{viewId}",
+            "sort": "created_at",
+            "filter": "AND({status}='active', {owner}='{userId}')",
+        },
+        "headers": {"Authorization": "Bearer {idToken}"},
+    }
+)
+config_params = {"baseId": "app123", "idToken": "token", "viewId": "viw456"}
+route_params = {"tableName": "Projects", "userId": "usr789"}
+
+
+def partial_format_path(cursor):
+    # Before: PropertyTree.dict() and apply_nested(partial_format) twice per page
+    attributes = request.dict()
+    attributes["url"] = attributes["url"].format_map(
+        {**route_params, **config_params, "cursor": cursor}
+    )
+    attributes = apply_nested(attributes, lambda x: partial_format(x, **route_params))
+    return apply_nested(attributes, lambda x: partial_format(x, **config_params))
+
+
+template = compile_nested(request.dict())
+
+
+def template_path(cursor):
+    # After: the request is compiled once, rendered once per page
+    return render_nested(template, {**config_params, **route_params, "cursor": cursor})
+
+
+if __name__ == "__main__":
+    assert partial_format_path(1) == template_path(1)
+    before = timeit.timeit(
+        lambda: [partial_format_path(i) for i in range(PAGES)], number=3
+    )
+    after = timeit.timeit(lambda: [template_path(i) for i in range(PAGES)], number=3)
+    print(f"partial_format: {before / 3 / PAGES * 1e6:.1f} µs/page")
+    print(f"template:       {after / 3 / PAGES * 1e6:.1f} µs/page")
+    print(f"speedup:        x{before / after:.1f}")
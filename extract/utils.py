@@ -1,7 +1,6 @@
 import json
 import re
 from functools import reduce
-from typing import Any, Dict
 
 
 class PropertyTree:
@@ -25,33 +24,13 @@ class PropertyTree:
     def __repr__(self):
         return json.dumps(self.dict())
 
-    # TODO: fix
     def select(self, path, fallback=None):
         """
-        Select the key from a nested dict, if the key is not found, return None
+        Select the key from a nested dict, if the key is not found, return fallback
         path = 'a.b.c'
         """
-        obj = self.dict()
-        return reduce(
-            lambda d, k: d.get(k, fallback) if d else fallback, path.split("."), obj
-        )
-
-
-def dict_to_obj_tree(yaml_config: Dict[str, Any]) -> PropertyTree:
-    tree = PropertyTree()
-    if isinstance(yaml_config, dict):
-        for key, value in yaml_config.items():
-            if type(value) == dict:
-                setattr(tree, key, dict_to_obj_tree(value))
-            elif type(value) == list:
-                setattr(tree, key, [dict_to_obj_tree(v) for v in value])
-            else:
-                setattr(tree, key, value)
-    elif isinstance(yaml_config, list):
-        return [dict_to_obj_tree(v) for v in yaml_config]
-    else:
-        return yaml_config
-    return tree
+        value = deep_get(self.dict(), path)
+        return fallback if value is None else value
 
 
 def deep_get(dictionary, keys, default=None):
@@ -76,16 +55,136 @@ def partial_format(s, **kwargs):
     return "".join(parts)
 
 
-def apply_nested(obj, func):
-    # Iterate on nested dict and format
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            if isinstance(v, dict):
-                obj[k] = apply_nested(v, func)
-            elif isinstance(v, str):
-                obj[k] = func(v)
-            elif isinstance(v, list):
-                obj[k] = [apply_nested(i, func) for i in v]
+PLACEHOLDER = re.compile(r"(\{[^}]*\})")
+FIELD = re.compile(r"\{([^!:}]*)(?:!([rsa]))?(?::([^}]*))?\}")
+CONVERSIONS = {None: lambda v: v, "r": repr, "s": str, "a": ascii}
+
+
+class Template:
+    """A string with {placeholders}, parsed once to be rendered many times.
+    Like partial_format, placeholders without a value are kept as they are.
+    """
+
+    __slots__ = ("text", "parts")
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = []  # literal strings, or (placeholder, name, conversion, spec)
+        for part in PLACEHOLDER.split(text):
+            match = FIELD.fullmatch(part)
+            if match:
+                name, conversion, spec = match.groups()
+                self.parts.append((part, name, CONVERSIONS[conversion], spec or ""))
+            elif part:
+                self.parts.append(part)
+
+    def __repr__(self):
+        return f"Template({self.text!r})"
+
+    def render(self, params):
+        if len(self.parts) == 1 and isinstance(self.parts[0], str):
+            return self.text  # No placeholder
+
+        rendered = []
+        for part in self.parts:
+            if isinstance(part, str):
+                rendered.append(part)
+                continue
+            placeholder, name, conversion, spec = part
+            if name in params:
+                rendered.append(format(conversion(params[name]), spec))
             else:
-                obj[k] = v
+                rendered.append(placeholder)
+        return "".join(rendered)
+
+
+def compile_nested(obj):
+    """Copy of the nested dict, with its strings compiled to Templates
+    (same traversal as apply_nested)
+    """
+    return apply_nested(obj, Template)
+
+
+def render_nested(obj, params):
+    """Render a nested dict from compile_nested, return a new dict"""
+    if isinstance(obj, Template):
+        return obj.render(params)
+    if isinstance(obj, dict):
+        return {k: render_nested(v, params) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [render_nested(i, params) for i in obj]
     return obj
+
+
+def apply_nested(obj, func):
+    # Iterate on nested dict and format, return a copy
+    if not isinstance(obj, dict):
+        return obj
+    new_obj = {}
+    for k, v in obj.items():
+        if isinstance(v, dict):
+            new_obj[k] = apply_nested(v, func)
+        elif isinstance(v, str):
+            new_obj[k] = func(v)
+        elif isinstance(v, list):
+            new_obj[k] = [apply_nested(i, func) for i in v]
+        else:
+            new_obj[k] = v
+    return new_obj
+
+
+def path_tree(paths):
+    """Dotted paths as a nested dict, True at the end of a path:
+    ["a.b", "a.c", "d"] -> {"a": {"b": True, "c": True}, "d": True}
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        *parents, last = path.split(".")
+        for key in parents:
+            node = node.setdefault(key, {})
+            if node is True:  # The parent is already kept whole
+                break
+        else:
+            node[last] = True
+    return tree
+
+
+class Projection:
+    """Keep the `fields` of an item, and/or remove the `exclude` ones.
+    Paths are dotted, and go through lists (eg: "items.body").
+    Return a new item, the original is not modified.
+    """
+
+    def __init__(self, fields=None, exclude=None):
+        self.fields = path_tree(fields) if fields else None
+        self.exclude = path_tree(exclude) if exclude else None
+
+    def __call__(self, item):
+        if self.fields is not None:
+            item = self._keep(item, self.fields)
+        if self.exclude is not None:
+            item = self._drop(item, self.exclude)
+        return item
+
+    def _keep(self, value, tree):
+        if isinstance(value, list):
+            return [self._keep(v, tree) for v in value]
+        if not isinstance(value, dict):
+            return value
+        return {
+            k: value[k] if sub is True else self._keep(value[k], sub)
+            for k, sub in tree.items()
+            if k in value
+        }
+
+    def _drop(self, value, tree):
+        if isinstance(value, list):
+            return [self._drop(v, tree) for v in value]
+        if not isinstance(value, dict):
+            return value
+        return {
+            k: v if k not in tree else self._drop(v, tree[k])
+            for k, v in value.items()
+            if tree.get(k) is not True
+        }
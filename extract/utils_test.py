@@ -0,0 +1,66 @@
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.utils import (
+    Projection,
+    Template,
+    compile_nested,
+    partial_format,
+    render_nested,
+)
+
+
+def test_template_matches_partial_format():
+    params = {"id": 42, "name": "hn", "price": 3.14159}
+    for text in [
+        "/item/{id}.json",
+        "/{name}/{id}/{missing}",
+        "{price:.2f} {name!r}",
+        "no placeholder",
+    ]:
+        assert Template(text).render(params) == partial_format(text, **params)
+
+
+def test_template_positional_key():
+    # Looping formats the id in "{0}", partial_format can't
+    assert Template("/item/{0}.json").render({"0": 8863}) == "/item/8863.json"
+
+
+def test_render_nested():
+    template = compile_nested(
+        {"url": "/{id}", "params": {"q": "{q}", "limit": 10}, "tags": ["{q}"]}
+    )
+    request = render_nested(template, {"id": 1, "q": "x"})
+    assert request == {"url": "/1", "params": {"q": "x", "limit": 10}, "tags": ["{q}"]}
+    # The template is rendered again, not modified
+    assert render_nested(template, {"id": 2})["url"] == "/2"
+    assert render_nested(template, {})["params"]["q"] == "{q}"
+
+
+def test_projection():
+    item = {
+        "id": 1,
+        "title": "t",
+        "by": {"name": "n", "avatar": "a"},
+        "items": [{"body": "<p>", "id": 2}, {"id": 3}],
+    }
+    keep = Projection(fields=["id", "by.name", "items.id"])
+    assert keep(item) == {"id": 1, "by": {"name": "n"}, "items": [{"id": 2}, {"id": 3}]}
+
+    drop = Projection(exclude=["title", "by.avatar", "items.body"])
+    assert drop(item) == {
+        "id": 1,
+        "by": {"name": "n"},
+        "items": [{"id": 2}, {"id": 3}],
+    }
+    assert item["by"]["avatar"] == "a"  # Not modified
+
+
+if __name__ == "__main__":
+    test_template_matches_partial_format()
+    test_template_positional_key()
+    test_render_nested()
+    test_projection()
@@ -0,0 +1,70 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WorkQueue:
+    """Bounded pool of workers for the dependent routes
+
+    Tasks are deduplicated by key for the lifetime of the queue (one run).
+    When `max_pending` tasks are already waiting, `submit` blocks until one is
+    done: it slows down the producer, and every error goes through `join`.
+    Tasks submitted by a task of the queue never block, the workers would
+    otherwise all wait for each other.
+    """
+
+    def __init__(self, max_workers=4, max_pending=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_pending = max_pending or max_workers * 10
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.worker = threading.local()
+        self.futures = deque()
+        self.seen = set()
+        self.lock = threading.RLock()
+
+    def _run(self, func, *args):
+        self.worker.active = True
+        return func(*args)
+
+    def _release(self, future):
+        self.slots.release()
+
+    def submit(self, key, func, *args):
+        """Run `func(*args)` once per key, return False if already submitted"""
+        with self.lock:
+            if key in self.seen:
+                return False
+            self.seen.add(key)
+
+        bounded = not getattr(self.worker, "active", False)
+        if bounded:
+            self.slots.acquire()
+        try:
+            future = self.executor.submit(self._run, func, *args)
+        except BaseException:
+            if bounded:
+                self.slots.release()
+            raise
+        if bounded:
+            future.add_done_callback(self._release)
+        with self.lock:
+            self.futures.append((key, future))
+        return True
+
+    def join(self):
+        """Wait for all the tasks, including the ones submitted meanwhile.
+        Return the errors as a list of (key, exception).
+        """
+        errors = []
+        while True:
+            with self.lock:
+                if not self.futures:
+                    return errors
+                key, future = self.futures.popleft()
+            try:
+                future.result()
+            except Exception as err:
+                errors.append((key, err))
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
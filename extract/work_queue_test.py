@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from extract.work_queue import WorkQueue
+
+
+def test_submit_blocks_and_errors_go_through_join():
+    queue = WorkQueue(max_workers=1, max_pending=2)
+    release = threading.Event()
+    submitted = []
+
+    def task(value):
+        release.wait()
+        if value % 2:
+            raise ValueError(value)
+
+    def produce():
+        for value in range(5):
+            queue.submit(value, task, value)
+            submitted.append(value)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(timeout=0.2)
+    assert submitted == [0, 1]  # blocked until a task is done
+
+    release.set()
+    producer.join()
+    errors = queue.join()
+    queue.close()
+    assert submitted == [0, 1, 2, 3, 4]
+    assert sorted(key for key, _ in errors) == [1, 3]
+
+
+def test_tasks_can_submit_tasks():
+    queue = WorkQueue(max_workers=1, max_pending=1)
+    done = []
+
+    def task(value):
+        if value < 5:
+            queue.submit(value + 1, task, value + 1)
+        done.append(value)
+
+    queue.submit(0, task, 0)
+    assert queue.join() == []
+    queue.close()
+    assert sorted(done) == list(range(6))
+
+
+if __name__ == "__main__":
+    test_submit_blocks_and_errors_go_through_join()
+    test_tasks_can_submit_tasks()
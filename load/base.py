@@ -1,21 +1,16 @@
 import hashlib
+import json
 
 import sqlalchemy as sa
-import yaml
 from loguru import logger
-from sqlalchemy import Boolean, Column, DateTime, Integer, String, create_engine
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, create_engine, text
+from sqlalchemy.dialects.postgresql import JSONB, insert
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import Session
 from sqlalchemy.sql import func
 
-Base = declarative_base()
-
+from extract.registry import registry
 
-def read_source_name(source_name):
-    with open(f"./extract/sources/{source_name}.yml") as f:
-        source_config = yaml.safe_load(f)
-    return source_config
+Base = declarative_base()
 
 
 def mini_hash(params):
@@ -24,6 +19,14 @@ def mini_hash(params):
     return hash[:10]
 
 
+def data_hash(item):
+    """Hash of the item, with a canonical json encoding (sorted keys, no spaces)"""
+    data = json.dumps(
+        item, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha1(data.encode("UTF-8")).hexdigest()
+
+
 class Entity(Base):
     __tablename__ = "__ud_entities"
 
@@ -38,6 +41,7 @@ class Entity(Base):
     created_at = Column(DateTime(timezone=True), nullable=False, default=func.now())
     processed = Column(Boolean(), default=False)
     data = Column(JSONB)
+    data_hash = Column(String(), nullable=True)  # see data_hash()
     key = Column("__key", String(), nullable=True, primary_key=True)
 
     # unique constraint on entity and key
@@ -45,17 +49,63 @@ class Entity(Base):
 
 
 class DataWarehouse:
+    chunk_size = 1000  # rows per statement
+
     def __init__(self, uri):
         self.engine = create_engine(uri, pool_pre_ping=True)
         Base.metadata.create_all(self.engine)
-        self.session = Session(bind=self.engine)
+        self._migrate()
+
+    def _migrate(self):
+        """Add the data_hash column to the stage databases created before it"""
+        columns = sa.inspect(self.engine).get_columns("__ud_entities")
+        if "data_hash" in [column["name"] for column in columns]:
+            return
+        logger.info("Add column __ud_entities.data_hash")
+        with self.engine.begin() as conn:
+            conn.execute(
+                "ALTER TABLE __ud_entities ADD COLUMN IF NOT EXISTS data_hash VARCHAR"
+            )
+        self._backfill_data_hash()
+
+    def _backfill_data_hash(self):
+        """Compute the hash of the rows without one, by chunks"""
+        while True:
+            with self.engine.begin() as conn:
+                rows = conn.execute(
+                    text(
+                        """
+                        SELECT "__key", data
+                        FROM __ud_entities
+                        WHERE data_hash IS NULL
+                        LIMIT :limit
+                        """
+                    ),
+                    {"limit": self.chunk_size},
+                ).all()
+                if not rows:
+                    return
+                conn.execute(
+                    text(
+                        """
+                        UPDATE __ud_entities AS e
+                        SET data_hash = v.hash
+                        FROM unnest(CAST(:keys AS text[]), CAST(:hashes AS text[])) AS v(key, hash)
+                        WHERE e."__key" = v.key
+                        """
+                    ),
+                    {
+                        "keys": [row[0] for row in rows],
+                        "hashes": [data_hash(row[1]) for row in rows],
+                    },
+                )
+                logger.debug(f"Backfilled data_hash of {len(rows)} rows")
 
     def _get_entity_keys(self, source_id, entity):
-        source_config = read_source_name(source_id)
-        for source_entity, keys in source_config["entities"].items():
-            if source_entity == entity:
-                return keys
-        raise ValueError(f"Keys not found for entity {entity}")
+        return registry.get(source_id).entity_keys(entity)
+
+    def _get_entity_projection(self, source_id, entity):
+        return registry.get(source_id).entity_projection(entity)
 
     def _get_active_entities(self):
         with self.engine.begin() as conn:
@@ -67,38 +117,64 @@ class DataWarehouse:
             ).all()
             return [dict(r) for r in rows]
 
+    def _entity_key(self, entity, entity_keys, item):
+        if len(entity_keys) > 1:
+            # If multiple key, create a hash of the keys
+            return mini_hash([entity] + [item[k] for k in entity_keys])
+        entity_key = entity_keys[0]
+        return mini_hash([entity] + [item[entity_key]])
+
+    def _upsert(self, conn, rows):
+        """Insert the new rows, update the changed ones, in one statement.
+        Return the number of inserted and updated rows.
+        """
+        table = Entity.__table__
+        stmt = insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.entity, table.c["__key"]],
+            set_={
+                "data": stmt.excluded.data,
+                "data_hash": stmt.excluded.data_hash,
+                "processed": False,
+            },
+            # Compare the hashes, not the payloads
+            where=table.c.data_hash.is_distinct_from(stmt.excluded.data_hash),
+        ).returning(sa.literal_column("xmax = 0").label("inserted"))
+
+        results = conn.execute(stmt).all()
+        inserted = sum(1 for r in results if r.inserted)
+        return inserted, len(results) - inserted
+
     def load(self, source_id, entity, items):
         logger.debug(f"Saving {len(items)} {entity} from {source_id}")
         entity_keys = self._get_entity_keys(source_id, entity)
+        projection = self._get_entity_projection(source_id, entity)
 
+        # A statement can't update the same row twice, keep the last item
+        rows = {}
         for item in items:
-            if len(entity_keys) > 1:
-                # If multiple key, create a hash of the keys
-                key = mini_hash([entity] + [item[k] for k in entity_keys])
-            else:
-                entity_key = entity_keys[0]
-                key = mini_hash([entity] + [item[entity_key]])
-
-            # Check if the entity already exists
-            instance = (
-                self.session.query(Entity).filter_by(entity=entity, key=key).first()
-            )
-            if instance:
-                logger.debug(f"Entity {key} already exists")
-                # If data is the same, skip
-                if instance.data == item:
-                    continue
-                # If data is different, update
-                else:
-                    instance.data = item
-                    instance.processed = False
-            else:
-                instance = Entity(
-                    source_id=source_id,
-                    entity=entity,
-                    data=item,
-                    key=key,
-                    processed=False,
-                )
-                self.session.add(instance)
-        self.session.commit()
+            key = self._entity_key(entity, entity_keys, item)
+            if projection is not None:
+                # Only the fields we use are stored (and hashed)
+                item = projection(item)
+            rows[key] = {
+                "source_id": source_id,
+                "entity": entity,
+                "data": item,
+                "data_hash": data_hash(item),
+                "__key": key,
+                "processed": False,
+            }
+        rows = list(rows.values())
+
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        with self.engine.begin() as conn:
+            for i in range(0, len(rows), self.chunk_size):
+                chunk = rows[i : i + self.chunk_size]
+                inserted, updated = self._upsert(conn, chunk)
+                counts["inserted"] += inserted
+                counts["updated"] += updated
+                counts["unchanged"] += len(chunk) - inserted - updated
+
+        logger.debug(f"Saved {entity} from {source_id}: {counts}")
+        return counts
@@ -0,0 +1,157 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+from loguru import logger
+
+CLOSE = object()
+
+
+class BufferedLoader:
+    """Wrap a loader (eg: DataWarehouse) to load from a background thread.
+
+    Items are buffered by (source_id, entity), and loaded every `max_rows`
+    items, `max_bytes` (json size) or `max_seconds`, whichever comes first.
+    `load` only blocks when `max_queue` calls are waiting (backpressure).
+    `close` loads the remaining items and raises the error of the worker, if any.
+
+    Each `load` call has a sequence number. Callbacks given to `on_loaded` are
+    called (from the worker) once every call before them is in the database:
+    that's when the crawler can save a cursor or cache a response.
+    """
+
+    def __init__(
+        self,
+        loader,
+        max_rows=1000,
+        max_bytes=10 * 1024**2,
+        max_seconds=5,
+        max_queue=100,
+    ):
+        self.loader = loader
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.lock = threading.Lock()
+        self.queue_lock = threading.Lock()  # `put` may block, not under `lock`
+        self.sequence = 0  # of the last `load` call
+        self.loaded = 0  # every call up to this one is loaded
+        self.callbacks = deque()  # (sequence, callback)
+        self.unloaded = {}  # sequences of the buffered calls, in order
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Don't hide the error of the crawler
+        self.close(raise_error=exc is None)
+
+    def load(self, source_id, entity, items):
+        if self.error:
+            raise self.error
+        with self.queue_lock:
+            # Sequences are queued in order
+            self.sequence += 1
+            self.queue.put((self.sequence, source_id, entity, list(items)))
+
+    def on_loaded(self, callback):
+        """Call `callback` once the items of the previous `load` calls are loaded.
+        It's never called if they fail to load.
+        """
+        with self.lock:
+            if self.loaded < self.sequence:
+                self.callbacks.append((self.sequence, callback))
+                return
+        callback()
+
+    def join(self):
+        """Load the buffered items now, and wait for them (and their callbacks)"""
+        if self.thread.is_alive():
+            done = threading.Event()
+            self.queue.put(done)
+            done.wait()
+        if self.error:
+            raise self.error
+
+    def close(self, raise_error=True):
+        self.queue.put(CLOSE)
+        self.thread.join()
+        if self.error:
+            if raise_error:
+                raise self.error
+            logger.error(f"Error while loading: {self.error!r}")
+
+    def _flush(self, buffers, key):
+        items, _, sequences = buffers.pop(key)
+        if items and not self.error:
+            try:
+                self.loader.load(*key, items)
+            except Exception as err:
+                # Raised to the crawler on the next `load`, or on `close`
+                logger.exception("Error while loading")
+                self.error = err
+        if not self.error:
+            for sequence in sequences:
+                del self.unloaded[sequence]
+
+    def _acknowledge(self, received):
+        """Run the callbacks of the calls loaded so far"""
+        if self.error:
+            return
+        loaded = next(iter(self.unloaded)) - 1 if self.unloaded else received
+        with self.lock:
+            self.loaded = loaded
+            callbacks = []
+            while self.callbacks and self.callbacks[0][0] <= loaded:
+                callbacks.append(self.callbacks.popleft()[1])
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as err:
+                logger.exception("Error in a load callback")
+                self.error = err
+                return
+
+    def _run(self):
+        buffers = {}  # (source_id, entity) -> (items, bytes, sequences)
+        received = 0
+        flushed_at = time.monotonic()
+        while True:
+            timeout = self.max_seconds - (time.monotonic() - flushed_at)
+            try:
+                message = self.queue.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                message = None
+
+            if message is CLOSE or isinstance(message, threading.Event):
+                for key in list(buffers):
+                    self._flush(buffers, key)
+                self._acknowledge(received)
+                if message is CLOSE:
+                    return
+                message.set()
+                continue
+
+            if message is not None:
+                received, source_id, entity, items = message
+                self.unloaded[received] = None
+                key = (source_id, entity)
+                buffer, size, sequences = buffers.setdefault(key, ([], 0, []))
+                buffer.extend(items)
+                sequences.append(received)
+                size += sum(len(json.dumps(item, default=str)) for item in items)
+                buffers[key] = (buffer, size, sequences)
+                if len(buffer) >= self.max_rows or size >= self.max_bytes:
+                    self._flush(buffers, key)
+
+            if time.monotonic() - flushed_at >= self.max_seconds:
+                for key in list(buffers):
+                    self._flush(buffers, key)
+                flushed_at = time.monotonic()
+            self._acknowledge(received)
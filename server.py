@@ -5,13 +5,13 @@ from datetime import datetime
 
 import schedule
 import sqlalchemy as sa
-import yaml
 from decouple import config as env
 from loguru import logger
 from sqlalchemy_utils import database_exists
 
 from database import STATUS, Pipeline, Session, Task
 from extract import scraper
+from extract.registry import registry
 from load.base import DataWarehouse
 from transfer.database import Stage
 from transfer.transfer import transfer
@@ -107,9 +107,7 @@ def record_task(task_type):
 def run_extract_task(pipeline):
     _session = Session()
 
-    source_name = pipeline.source.name
-    with open(f"./extract/sources/{source_name}.yml") as f:
-        source_config = yaml.safe_load(f)
+    source = registry.get(pipeline.source.name)
 
     # Create stage_uri database if it doesn't exist
     stage_engine = sa.create_engine(pipeline.stage_uri)
@@ -121,13 +119,15 @@ def run_extract_task(pipeline):
         session.connection().connection.set_isolation_level(1)
 
     logger.info("Run extract")
-    scraper.runner(
-        source_config,
+    stats = scraper.runner(
+        source,
         pipeline.stage_uri,
         debug=DEBUG,
         memory=pipeline.source,
         params=pipeline.source.config,
     )
+    # hit/miss/not_modified of the cache, requests shared with other pipelines
+    logger.info(f"Extract pipeline {pipeline.id} requests: {stats}")
     # Start transform status to queued
     pipeline.transform_status = STATUS.QUEUED
     _session.commit()
@@ -0,0 +1,126 @@
+# Benchmark: rows/s of Transformer._insert_data, pandas to_sql (before) vs COPY
+# BENCH_DATABASE_URI=postgresql://localhost/bench python transform/insert_bench.py
+import os
+import sys
+import time
+from typing import Dict, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+import sqlalchemy as sa
+
+from transform.types import (
+    generate_jsonschema,
+    jsonschema_to_postgres_types,
+    pg_type_to_sqlalchemy_type,
+)
+from transform.utils import Transformer, fix_array_string
+
+ROWS = 100_000
+OUTPUT_TABLE = "__bench_insert"
+
+
+def make_rows(count):
+    return [
+        {
+            "__key": str(i),
+            "__hash": str(i),
+            "id": i,
+            "title": f'item "{i}"',
+            "score": i % 100 / 3,
+            "active": i % 2 == 0,
+            "author": {"name": "ben", "karma": i},
+            "tags": ["a", "b", str(i)],
+        }
+        for i in range(count)
+    ]
+
+
+def create_upsert_method(
+    meta: sa.MetaData, extra_update_fields: Optional[Dict[str, str]] = None
+):
+    """
+    Create upsert method that satisfied the pandas's to_sql API.
+    """
+
+    def method(table, conn, keys, data_iter):
+        # select table that data is being inserted to (from pandas's context)
+        sql_table = sa.Table(table.name, meta, autoload=True)
+
+        # list of dictionaries {col_name: value} of data to insert
+        values_to_insert = [dict(zip(keys, data)) for data in data_iter]
+
+        # create insert statement using postgresql dialect.
+        # For other dialects, please refer to https://docs.sqlalchemy.org/en/14/dialects/
+        insert_stmt = sa.dialects.postgresql.insert(sql_table, values_to_insert)
+
+        # create update statement for excluded fields on conflict
+        update_stmt = {exc_k.key: exc_k for exc_k in insert_stmt.excluded}
+        if extra_update_fields:
+            update_stmt.update(extra_update_fields)
+
+        # create upsert statement.
+        upsert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=sql_table.primary_key.columns,  # index elements are primary keys of a table
+            set_=update_stmt,  # the SET part of an INSERT statement
+        )
+
+        # execute upsert statement
+        conn.execute(upsert_stmt)
+
+    return method
+
+
+def insert_with_pandas(transformer, rows):
+    """The write path before COPY"""
+    import pandas as pd
+
+    dtypes = {
+        k: pg_type_to_sqlalchemy_type(t)
+        for k, t in transformer.output_table_types.items()
+    }
+    df = pd.DataFrame(rows)
+    upsert_method = create_upsert_method(sa.MetaData(transformer.engine))
+    for key in df.columns:
+        if dtypes[key] == sa.Text:
+            df[key] = df[key].astype(str)
+        elif repr(dtypes[key]) == "ARRAY(Text())":
+            df[key] = df[key].apply(fix_array_string)
+    df.to_sql(
+        transformer.output_table,
+        transformer.engine,
+        index=False,
+        if_exists="append",
+        chunksize=transformer.chunk_size,
+        method=upsert_method,
+        dtype=dtypes,
+    )
+
+
+def bench(transformer, insert, rows):
+    transformer._create_table()
+    start = time.perf_counter()
+    for i in range(0, len(rows), transformer.chunk_size):
+        insert(rows[i : i + transformer.chunk_size])
+    return len(rows) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    engine = sa.create_engine(os.environ["BENCH_DATABASE_URI"])
+    rows = make_rows(ROWS)
+    transformer = Transformer(
+        engine=engine,
+        output_table=OUTPUT_TABLE,
+        transform=lambda row: row,
+        primary_key="__key",
+    )
+    schema = generate_jsonschema(rows[:1000])
+    transformer.output_table_jsonschema = schema
+    transformer.output_table_types = jsonschema_to_postgres_types(schema)
+
+    pandas_rate = bench(transformer, lambda c: insert_with_pandas(transformer, c), rows)
+    copy_rate = bench(transformer, transformer._insert_data, rows)
+    print(f"pandas to_sql: {pandas_rate:8.0f} rows/s")
+    print(f"copy + merge:  {copy_rate:8.0f} rows/s (x{copy_rate / pandas_rate:.1f})")
+    engine.execute(f'DROP TABLE "{OUTPUT_TABLE}"')
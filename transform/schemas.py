@@ -0,0 +1,56 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB, insert
+from sqlalchemy.sql import func
+
+metadata = sa.MetaData()
+
+schemas_table = sa.Table(
+    "__ud_schemas",
+    metadata,
+    sa.Column("output_table", sa.String(), primary_key=True),
+    sa.Column("jsonschema", JSONB, nullable=False),
+    sa.Column("pg_types", JSONB, nullable=False),
+    # row_shape() pairs of the rows already in the schema
+    sa.Column("shapes", JSONB, nullable=False),
+    sa.Column(
+        "updated_at",
+        sa.DateTime(timezone=True),
+        nullable=False,
+        default=func.now(),
+        onupdate=func.now(),
+    ),
+)
+
+
+class SchemaStore:
+    """Inferred schema of the output tables, kept in the stage database
+    so a run only infers the rows it hasn't seen yet.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        metadata.create_all(self.engine)
+
+    def get(self, output_table):
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                sa.select(schemas_table).where(
+                    schemas_table.c.output_table == output_table
+                )
+            ).first()
+        return dict(row._mapping) if row else None
+
+    def save(self, output_table, jsonschema, pg_types, shapes):
+        values = {
+            "output_table": output_table,
+            "jsonschema": jsonschema,
+            "pg_types": pg_types,
+            "shapes": sorted(shapes),
+        }
+        stmt = insert(schemas_table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[schemas_table.c.output_table],
+            set_={**values, "updated_at": func.now()},
+        )
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
@@ -0,0 +1,65 @@
+# Benchmark: transform N raw rows, the time per row should not grow with N
+# BENCH_DATABASE_URI=postgresql://localhost/bench python transform/transform_bench.py
+import os
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+import sqlalchemy as sa
+
+from transform.utils import Transformer
+
+SIZES = [10_000, 100_000, 1_000_000]
+INPUT_TABLE = "__bench_entities"
+OUTPUT_TABLE = "__bench_output"
+
+
+def create_input(engine, size):
+    engine.execute(f'DROP TABLE IF EXISTS "{INPUT_TABLE}"')
+    engine.execute(f'DROP TABLE IF EXISTS "{OUTPUT_TABLE}"')
+    engine.execute(
+        f"""
+        CREATE TABLE "{INPUT_TABLE}" (
+            "__key" VARCHAR PRIMARY KEY,
+            processed BOOLEAN DEFAULT FALSE,
+            data JSONB
+        )
+        """
+    )
+    engine.execute(
+        f"""
+        INSERT INTO "{INPUT_TABLE}" ("__key", data)
+        SELECT md5(i::text), jsonb_build_object(
+            'id', i,
+            'title', 'item ' || i,
+            'score', i % 100,
+            'tags', jsonb_build_array('a', 'b')
+        )
+        FROM generate_series(1, {size}) AS i
+        """
+    )
+
+
+def bench(engine, size):
+    create_input(engine, size)
+    transformer = Transformer(
+        engine=engine,
+        input_table=INPUT_TABLE,
+        input_sql=f'SELECT * FROM "{INPUT_TABLE}"',
+        process_key="processed",
+        primary_key="__key",
+        output_table=OUTPUT_TABLE,
+        transform=lambda row: row["data"],
+    )
+    start = time.perf_counter()
+    transformer.run()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    engine = sa.create_engine(os.environ["BENCH_DATABASE_URI"])
+    for size in SIZES:
+        seconds = bench(engine, size)
+        print(f"{size:>9} rows: {seconds:8.1f}s, {size / seconds:8.0f} rows/s")
@@ -0,0 +1,214 @@
+import csv
+import io
+import json
+import os
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from transform.schemas import SchemaStore
+from transform.utils import Transformer, copy_field, escape_colons
+
+# Postgres database of the tests, eg: postgresql://localhost/test
+TEST_DATABASE_URI = os.environ.get("TEST_DATABASE_URI")
+INPUT_TABLE = "__test_entities"
+OUTPUT_TABLE = "__test_output"
+
+
+def test_copy_field():
+    assert copy_field(None, "text") == "\\N"
+    assert copy_field("\\N", "text") == '"\\N"'  # A string, not NULL
+    assert copy_field('say "hi"', "text") == '"say ""hi"""'
+    assert copy_field(1.5, "numeric") == '"1.5"'
+    assert copy_field(True, "boolean") == '"true"'
+    assert copy_field({"a": [1]}, "jsonb") == '"{""a"": [1]}"'
+    assert copy_field(["a", 'b"c', None], "text[]") == '"{""a"",""b\\""c"",""None""}"'
+    assert copy_field([1, None], "numeric[]") == '"{""1"",NULL}"'
+    assert copy_field([{"a": 1}], "jsonb[]") == '"{""{\\""a\\"": 1}""}"'
+    # Objects in text columns are JSON, not a Python repr
+    assert copy_field({"a": None}, "text") == '"{""a"": null}"'
+    assert copy_field([{"a": 1}], "text[]") == '"{""{\\""a\\"": 1}""}"'
+
+
+def test_copy_line_is_csv():
+    line = ",".join(
+        copy_field(value, pg_type)
+        for value, pg_type in [("a,\nb", "text"), (None, "numeric"), ([1], "text[]")]
+    )
+    assert next(csv.reader(io.StringIO(line))) == ["a,\nb", "\\N", '{"1"}']
+
+
+def test_escape_colons():
+    input_sql = "SELECT id, data::jsonb, '10:30' AS at FROM t WHERE name = ':name'"
+    query = text(f"SELECT * FROM ({escape_colons(input_sql)}) AS t WHERE id > :after")
+    compiled = query.compile(dialect=postgresql.dialect())
+    assert list(compiled.params) == ["after"]
+    assert input_sql in str(compiled)
+
+
+def test_update_process_key_query():
+    class Connection:
+        def execute(self, query, params):
+            self.query, self.params = query, params
+
+    transformer = Transformer(
+        engine=sa.create_engine("sqlite://"),
+        input_table=INPUT_TABLE,
+        input_sql=f'SELECT * FROM "{INPUT_TABLE}"',
+        process_key="processed",
+        primary_key="__key",
+        output_table=OUTPUT_TABLE,
+        transform=lambda row: row,
+    )
+    conn = Connection()
+    transformer._update_process_key(conn, [{"__key": "1"}, {"__key": "2"}])
+    compiled = conn.query.compile(dialect=postgresql.dialect())
+    assert " ".join(str(compiled).split()) == (
+        f'UPDATE "{INPUT_TABLE}" SET "processed" = TRUE '
+        'WHERE "__key" = ANY(%(keys)s)'
+    )
+    assert conn.params == {"keys": ["1", "2"]}
+
+
+def create_input_table(engine):
+    """Empty input and output tables, without a saved schema"""
+    engine.execute(f'DROP TABLE IF EXISTS "{INPUT_TABLE}", "{OUTPUT_TABLE}"')
+    SchemaStore(engine)
+    engine.execute(
+        text("DELETE FROM __ud_schemas WHERE output_table = :table"),
+        table=OUTPUT_TABLE,
+    )
+    engine.execute(
+        f"""
+        CREATE TABLE "{INPUT_TABLE}" (
+            "__key" VARCHAR PRIMARY KEY,
+            entity VARCHAR,
+            processed BOOLEAN DEFAULT FALSE,
+            data JSONB
+        )
+        """
+    )
+
+
+def test_evolve_table():
+    """New fields are added, and changed types are widened, in place"""
+    if not TEST_DATABASE_URI:
+        pytest.skip("TEST_DATABASE_URI isn't set")
+    engine = sa.create_engine(TEST_DATABASE_URI)
+    create_input_table(engine)
+
+    def add(key, data, entity="item", processed=False):
+        engine.execute(
+            text(
+                f"""
+                INSERT INTO "{INPUT_TABLE}" ("__key", entity, processed, data)
+                VALUES (:key, :entity, :processed, CAST(:data AS jsonb))
+                """
+            ),
+            key=key,
+            entity=entity,
+            processed=processed,
+            data=json.dumps(data),
+        )
+
+    def transformer():
+        return Transformer(
+            engine=engine,
+            input_table=INPUT_TABLE,
+            input_sql=f"SELECT * FROM \"{INPUT_TABLE}\" WHERE entity = 'item'",
+            process_key="processed",
+            primary_key="__key",
+            output_table=OUTPUT_TABLE,
+            transform=lambda row: row["data"],
+        )
+
+    add("0", {"other": 1}, entity="other", processed=True)
+    add("1", {"a": 1, "tags": [True]})
+    transformer().run()
+    add("2", {"a": 2, "b": "new"})  # ADD COLUMN
+    transformer().run()
+    add("3", {"a": "A3"})  # ALTER COLUMN a TYPE text
+    transformer().run()
+
+    types = transformer()._output_table_types()
+    assert types["a"] == "text"
+    assert types["b"] == "text"
+    assert types["tags"] == "boolean[]"
+    rows = engine.execute(
+        f'SELECT "__key", a, b FROM "{OUTPUT_TABLE}" ORDER BY "__key"'
+    ).all()
+    assert [tuple(row) for row in rows] == [
+        ("1", "1", None),
+        ("2", "2", "new"),
+        ("3", "A3", None),
+    ]
+    processed = engine.execute(
+        f'SELECT "__key", processed FROM "{INPUT_TABLE}" ORDER BY "__key"'
+    ).all()
+    assert all(row.processed for row in processed)
+
+
+def test_process_key_with_insert():
+    """The input rows are marked processed in the transaction of their insert,
+    in one statement for a large chunk"""
+    if not TEST_DATABASE_URI:
+        pytest.skip("TEST_DATABASE_URI isn't set")
+    engine = sa.create_engine(TEST_DATABASE_URI)
+    create_input_table(engine)
+    engine.execute(
+        text(
+            f"""
+            INSERT INTO "{INPUT_TABLE}" ("__key", entity, data)
+            SELECT lpad(i::text, 5, '0'), 'item', jsonb_build_object('i', i)
+            FROM generate_series(0, 49999) AS i
+            """
+        )
+    )
+
+    class FailingTransformer(Transformer):
+        def _update_process_key(self, conn, rows):
+            super()._update_process_key(conn, rows)
+            raise ValueError("Can't commit")
+
+    def transformer(cls=Transformer):
+        transformer = cls(
+            engine=engine,
+            input_table=INPUT_TABLE,
+            input_sql=f'SELECT * FROM "{INPUT_TABLE}"',
+            process_key="processed",
+            primary_key="__key",
+            output_table=OUTPUT_TABLE,
+            transform=lambda row: row["data"],
+        )
+        transformer.chunk_size = 50_000
+        return transformer
+
+    def count(query):
+        return engine.execute(query).scalar()
+
+    # Rolled back with the insert
+    with pytest.raises(ValueError):
+        transformer(FailingTransformer).run()
+    assert count(f'SELECT count(*) FROM "{OUTPUT_TABLE}"') == 0
+    assert count(f'SELECT count(*) FROM "{INPUT_TABLE}" WHERE processed') == 0
+
+    # Committed with the insert
+    transformer().run()
+    assert count(f'SELECT count(*) FROM "{OUTPUT_TABLE}"') == 50_000
+    assert count(f'SELECT count(*) FROM "{INPUT_TABLE}" WHERE processed') == 50_000
+
+
+if __name__ == "__main__":
+    test_copy_field()
+    test_copy_line_is_csv()
+    test_escape_colons()
+    test_update_process_key_query()
+    if TEST_DATABASE_URI:
+        test_evolve_table()
+        test_process_key_with_insert()
@@ -14,6 +14,43 @@ def generate_jsonschema(rows, schema=None):
     return remove_null_from_jsonschema(builder.to_schema())
 
 
+def row_shape(row):
+    """The "column:type" of each value of the row (and "column[]:type" of the
+    items of the lists): the type of a column only depends on the types seen
+    in it, not on the other keys of the rows. A row whose pairs are all known
+    can be skipped by the schema inference.
+    Unlike a hash of the keys, the known pairs grow with the columns, not with
+    the combinations of optional keys.
+    """
+    shape = set()
+    for key, value in row.items():
+        shape.add(f"{key}:{type(value).__name__}")
+        if isinstance(value, list):
+            shape.update(f"{key}[]:{type(v).__name__}" for v in value)
+    return frozenset(shape)
+
+
+def mixed_postgres_type(types):
+    """Column type for the values of several JSON types (eg: ["integer", "string"]),
+    wide enough for all of them"""
+    types = set(types) - {"null"}
+    if types <= {"integer", "number"}:
+        return "numeric"
+    if types & {"object", "array"}:
+        return "jsonb"
+    return "text"
+
+
+def any_of_types(schema):
+    """JSON types of the subschemas of an anyOf (genson keeps the objects and
+    the arrays apart from the scalars)"""
+    types = []
+    for subschema in schema["anyOf"]:
+        type = subschema.get("type", [])
+        types += type if isinstance(type, list) else [type]
+    return types
+
+
 def jsonschema_to_postgres_types(schema):
     """
     Convert a JSON schema to a list of columns and their types.
@@ -21,8 +58,10 @@ def jsonschema_to_postgres_types(schema):
 
     columns = {}
     for key, value in schema["properties"].items():
-        if "anyOf" in value:  # array of different types
-            columns[key] = "text"
+        if "anyOf" in value:  # values of different types, with objects or arrays
+            columns[key] = mixed_postgres_type(any_of_types(value))
+        elif isinstance(value["type"], list):  # values of different types
+            columns[key] = mixed_postgres_type(value["type"])
         elif value["type"] == "number":
             columns[key] = "numeric"
         elif value["type"] == "integer":
@@ -38,6 +77,8 @@ def jsonschema_to_postgres_types(schema):
                 columns[key] = "jsonb[]"  # empty array
             elif "anyOf" in value["items"]:  # array of different types
                 columns[key] = "text[]"
+            elif isinstance(value["items"]["type"], list):
+                columns[key] = mixed_postgres_type(value["items"]["type"]) + "[]"
             elif value["items"]["type"] == "string":
                 columns[key] = "text[]"
             elif value["items"]["type"] == "number":
@@ -58,6 +99,49 @@ def jsonschema_to_postgres_types(schema):
     return columns
 
 
+def alter_column_using(column, old_type, new_type):
+    """USING expression to convert a column to a wider type, in place.
+    None when the conversion would lose data (eg: text to numeric).
+    """
+    column = f'"{column}"'
+    if old_type == new_type:
+        return column
+    if new_type == "text":
+        if old_type.endswith("[]"):
+            return f"to_jsonb({column})::text"
+        return f"{column}::text"  # numeric, boolean, jsonb
+    if new_type == "text[]" and old_type.endswith("[]"):
+        return f"{column}::text[]"
+    if new_type == "jsonb":
+        return f"to_jsonb({column})"
+    return None
+
+
+# udt_name of information_schema.columns -> name of the type in the schema
+UDT_NAMES = {
+    "bool": "boolean",
+    "int2": "smallint",
+    "int4": "integer",
+    "int8": "bigint",
+    "float4": "real",
+    "float8": "double precision",
+    "varchar": "character varying",
+    "bpchar": "character",
+    "timestamp": "timestamp without time zone",
+    "timestamptz": "timestamp with time zone",
+}
+
+
+def column_pg_type(data_type, udt_name):
+    """Type of a column of information_schema.columns, named as in
+    jsonschema_to_postgres_types (the udt_name of an array is "_" + element)
+    """
+    if data_type == "ARRAY":
+        element = udt_name[1:]
+        return UDT_NAMES.get(element, element) + "[]"
+    return data_type
+
+
 def pg_type_to_sqlalchemy_type(pg_type):
     """
     Convert a Postgres type to a SQLAlchemy type.
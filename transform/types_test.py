@@ -6,9 +6,12 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
 from transform.types import (
+    alter_column_using,
+    column_pg_type,
     generate_jsonschema,
     jsonschema_to_postgres_types,
     remove_null_from_jsonschema,
+    row_shape,
 )
 
 examples_types = [
@@ -124,6 +127,45 @@ def test_jsonschema_to_postgres_type_with_null():
     assert jsonschema_to_postgres_types(jsonschema) == types_pg_2
 
 
+def test_jsonschema_to_postgres_type_with_mixed_types():
+    rows = [
+        {"id": 1, "ref": 1, "amount": 1, "meta": "a", "tags": [1], "data": 1},
+        {
+            "id": 2,
+            "ref": "A2",
+            "amount": 1.5,
+            "meta": {"a": 1},
+            "tags": ["a", True],
+            "data": [1],
+        },
+    ]
+    jsonschema = generate_jsonschema(rows)
+    assert jsonschema["properties"]["ref"]["type"] == ["integer", "string"]
+    assert "anyOf" in jsonschema["properties"]["meta"]
+    assert jsonschema_to_postgres_types(jsonschema) == {
+        "id": "numeric",
+        "ref": "text",
+        "amount": "numeric",
+        "meta": "jsonb",
+        "tags": "text[]",
+        "data": "jsonb",
+    }
+
+
+def test_widen_to_jsonb():
+    """A column getting objects or arrays is converted to jsonb in place"""
+    rows = [{"meta": "a", "data": 1, "tags": ["a"], "flag": True}]
+    before = jsonschema_to_postgres_types(generate_jsonschema(rows))
+    rows.append({"meta": {"a": 1}, "data": {"b": 2}, "tags": "a", "flag": [1]})
+    after = jsonschema_to_postgres_types(generate_jsonschema(rows))
+    assert {key: alter_column_using(key, before[key], after[key]) for key in after} == {
+        "meta": 'to_jsonb("meta")',
+        "data": 'to_jsonb("data")',
+        "tags": 'to_jsonb("tags")',
+        "flag": 'to_jsonb("flag")',
+    }
+
+
 def test_remove_null():
     jsonschema = {
         "$schema": "http://json-schema.org/schema#",
@@ -166,7 +208,57 @@ def test_remove_null():
     assert remove_null_from_jsonschema(jsonschema) == jsonschema_cleaned
 
 
+def test_row_shape():
+    rows = examples_types * 3 + [
+        {"id": 1, "name": "ben", "tags": [1, 2]},
+        {"id": 2, "name": "joe", "tags": [3]},
+        {"id": 3, "name": None, "tags": ["a"]},
+        {"id": 4},
+        {"name": "jim", "tags": []},
+    ]
+    assert row_shape(rows[-5]) == row_shape(rows[-4])
+    assert row_shape(rows[-4]) != row_shape(rows[-3])
+    assert row_shape(rows[-1]) <= row_shape(rows[-5])
+
+    # Only the rows bringing a new pair give the same column types as all the rows
+    known, new_rows = set(), []
+    for row in rows:
+        if not row_shape(row) <= known:
+            new_rows.append(row)
+            known |= row_shape(row)
+    assert len(new_rows) < len(rows)
+    assert jsonschema_to_postgres_types(
+        generate_jsonschema(new_rows)
+    ) == jsonschema_to_postgres_types(generate_jsonschema(rows))
+
+
+def test_alter_column_using():
+    assert alter_column_using("a", "numeric", "text") == '"a"::text'
+    assert alter_column_using("a", "jsonb", "text") == '"a"::text'
+    assert alter_column_using("a", "numeric[]", "text[]") == '"a"::text[]'
+    assert alter_column_using("a", "text[]", "text") == 'to_jsonb("a")::text'
+    assert alter_column_using("a", "boolean", "jsonb") == 'to_jsonb("a")'
+    # Narrowing would lose data
+    assert alter_column_using("a", "text", "numeric") is None
+    assert alter_column_using("a", "text", "text[]") is None
+
+
+def test_column_pg_type():
+    # (data_type, udt_name) of information_schema.columns
+    assert column_pg_type("numeric", "numeric") == "numeric"
+    assert column_pg_type("jsonb", "jsonb") == "jsonb"
+    assert column_pg_type("ARRAY", "_text") == "text[]"
+    assert column_pg_type("ARRAY", "_bool") == "boolean[]"
+    assert column_pg_type("ARRAY", "_jsonb") == "jsonb[]"
+    assert column_pg_type("ARRAY", "_numeric") == "numeric[]"
+    assert column_pg_type("ARRAY", "_int4") == "integer[]"
+
+
 if __name__ == "__main__":
     test_extract_type_from_json()
     test_jsonschema_to_postgres_types()
     test_remove_null()
+    test_row_shape()
+    test_alter_column_using()
+    test_widen_to_jsonb()
+    test_column_pg_type()
@@ -1,31 +1,84 @@
+import io
+import json
 from collections import defaultdict
 from time import sleep
-from typing import Dict, Optional
 
 import sqlalchemy as sa
 from loguru import logger
 from sqlalchemy import text
 from sqlalchemy.inspection import inspect
 
+from transform.schemas import SchemaStore
 from transform.types import (
+    alter_column_using,
+    column_pg_type,
     generate_jsonschema,
     jsonschema_to_postgres_types,
-    pg_type_to_sqlalchemy_type,
+    row_shape,
 )
 
 MAX_RETRIES = 10
 
 
 class UpdatedTableException(Exception):
-    """Raised when the table is updated by another process."""
+    """Raised when the output table can't be updated to the schema in place."""
 
     pass
 
 
+def escape_colons(sql):
+    """SQL to embed in a `text()` query: its `:word` aren't bind params
+    (eg: '10:30' or a cast), they are sent to Postgres as they are"""
+    return sql.replace(":", r"\:")
+
+
+def to_text(value):
+    """Text of a value for a text column: objects and arrays as JSON"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return str(value)
+
+
 def fix_array_string(items):
     if items and isinstance(items, list):
-        return [str(i) for i in items]
-    return [str(items)]
+        return [to_text(i) for i in items]
+    return [to_text(items)]
+
+
+def copy_scalar(value, pg_type):
+    """Text of a value for Postgres, as the pandas path converted it"""
+    if pg_type in ("jsonb", "jsonb[]"):
+        return json.dumps(value, default=str)
+    if isinstance(value, bool) and pg_type != "text":
+        return "true" if value else "false"
+    return to_text(value)
+
+
+def copy_array(values, pg_type):
+    """Postgres array literal: {"a","b",NULL}"""
+    if pg_type == "text[]":
+        values = fix_array_string(values)
+    elif not isinstance(values, list):
+        values = [values]
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        else:
+            value = copy_scalar(value, pg_type)
+            items.append('"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def copy_field(value, pg_type):
+    """A field of a COPY ... CSV line, NULL is \\N unquoted"""
+    if value is None:
+        return "\\N"
+    if pg_type.endswith("[]"):
+        value = copy_array(value, pg_type)
+    else:
+        value = copy_scalar(value, pg_type)
+    return '"' + value.replace('"', '""') + '"'
 
 
 def airtable_unnest_tables(rows):
@@ -44,41 +97,6 @@ def airtable_unnest_tables(rows):
     return tables
 
 
-def create_upsert_method(
-    meta: sa.MetaData, extra_update_fields: Optional[Dict[str, str]] = None
-):
-    """
-    Create upsert method that satisfied the pandas's to_sql API.
-    """
-
-    def method(table, conn, keys, data_iter):
-        # select table that data is being inserted to (from pandas's context)
-        sql_table = sa.Table(table.name, meta, autoload=True)
-
-        # list of dictionaries {col_name: value} of data to insert
-        values_to_insert = [dict(zip(keys, data)) for data in data_iter]
-
-        # create insert statement using postgresql dialect.
-        # For other dialects, please refer to https://docs.sqlalchemy.org/en/14/dialects/
-        insert_stmt = sa.dialects.postgresql.insert(sql_table, values_to_insert)
-
-        # create update statement for excluded fields on conflict
-        update_stmt = {exc_k.key: exc_k for exc_k in insert_stmt.excluded}
-        if extra_update_fields:
-            update_stmt.update(extra_update_fields)
-
-        # create upsert statement.
-        upsert_stmt = insert_stmt.on_conflict_do_update(
-            index_elements=sql_table.primary_key.columns,  # index elements are primary keys of a table
-            set_=update_stmt,  # the SET part of an INSERT statement
-        )
-
-        # execute upsert statement
-        conn.execute(upsert_stmt)
-
-    return method
-
-
 class Transformer:
     """Transform class, take a table from Postgres,
     Apply the data transformation
@@ -87,6 +105,8 @@ class Transformer:
 
     chunk_size = 1000
     output_table_jsonschema = None
+    output_table_types = None
+    table_types = None  # Columns of the output table, see _evolve_table
     update_retries = 0
 
     def __init__(
@@ -98,7 +118,14 @@ class Transformer:
         input_sql: str = None,
         primary_key=None,
         process_key=None,
+        schema_sample=10000,
+        infer_changed=True,
     ):
+        """The schema of the output table is saved in `__ud_schemas`.
+        The first run infers it from `schema_sample` input rows; then, with
+        `infer_changed`, it's updated with the rows to insert, skipping the
+        rows of a shape already seen.
+        """
         self.engine = engine
         self.input_sql = input_sql
         self.input_table = input_table
@@ -111,6 +138,9 @@ class Transformer:
         self.transform = transform
         self.meta = sa.MetaData(self.engine)
         self.process_key = process_key
+        self.schema_sample = schema_sample
+        self.infer_changed = infer_changed
+        self.shapes = set()
 
     def _extract_primary_keys(self, table_name):
         table = sa.Table(
@@ -144,8 +174,7 @@ class Transformer:
         return table_exist
 
     def _create_table(self):
-        schema = self.output_table_jsonschema
-        columns = jsonschema_to_postgres_types(schema)
+        columns = self.output_table_types
         pkey = self._get_primary_key()
         sql_columns = ", ".join(
             [
@@ -163,50 +192,60 @@ class Transformer:
         print(query)
         # Need to escape to avoid % in the query
         self.engine.execute(text(query))
+        self.table_types = dict(columns)
         print("Table created")
         sleep(1)
 
-    def _fetch_rows_to_insert(self, limit=None, reset=False):
+    def _fetch_rows_to_insert(self, limit=None, reset=False, after=None):
+        """Next rows to transform, in primary key order.
+        With `after` (the last key of the previous chunk), the input is walked
+        once by keyset pagination, instead of scanning it again for each chunk.
+        """
         self._get_primary_key()
 
+        conditions = []
+        if after is not None:
+            conditions.append(f't."{self.primary_key}" > :after')
+
         if self.process_key:
+            conditions.append(f't."{self.process_key}" IS NOT TRUE')
             query = f"""
                 SELECT t.*, md5(t::text) AS __hash
                 FROM (
-                    {self.input_sql}
+                    {escape_colons(self.input_sql)}
                 ) AS t
-                WHERE t."{self.process_key}" IS NOT TRUE
+                WHERE {" AND ".join(conditions)}
+                ORDER BY t."{self.primary_key}"
                 LIMIT {self.chunk_size if limit is None else limit}
             """
         else:
-            query_filter = (
-                f"""  
-                LEFT JOIN LATERAL (
-                    SELECT "{self.primary_key}"
-                    FROM "{self.output_table}" AS s
-                    WHERE t."{self.primary_key}" = s."{self.primary_key}"
-                    AND t.__hash = s.__hash
-                ) AS dest ON TRUE
-                WHERE True
-                AND dest."{self.primary_key}" IS NULL
-            """
-                if self._output_table_exist() and reset is False
-                else ""
-            )
+            query_filter = ""
+            if self._output_table_exist() and reset is False:
+                query_filter = f"""
+                    LEFT JOIN LATERAL (
+                        SELECT "{self.primary_key}"
+                        FROM "{self.output_table}" AS s
+                        WHERE t."{self.primary_key}" = s."{self.primary_key}"
+                        AND t.__hash = s.__hash
+                    ) AS dest ON TRUE
+                """
+                conditions.append(f'dest."{self.primary_key}" IS NULL')
 
             query = f"""
                 SELECT t.*, __hash
                 FROM (
                     SELECT t.*, md5(t::text) AS __hash
                     FROM (
-                        {self.input_sql}
+                        {escape_colons(self.input_sql)}
                     ) AS t
                 ) AS t
                 {query_filter}
+                WHERE {" AND ".join(conditions or ["TRUE"])}
+                ORDER BY t."{self.primary_key}"
                 LIMIT {self.chunk_size if limit is None else limit}
             """
 
-        rows_raw = self.engine.execute(query).all()
+        rows_raw = self.engine.execute(text(query), after=after).all()
 
         rows = []
         for row_raw in rows_raw:
@@ -220,78 +259,164 @@ class Transformer:
             rows.append(row)
         return rows
 
+    def _load_json_schema(self):
+        self.schemas = SchemaStore(self.engine)
+        saved = self.schemas.get(self.output_table)
+        if saved:
+            self.output_table_jsonschema = saved["jsonschema"]
+            self.output_table_types = saved["pg_types"]
+            self.shapes = set(saved["shapes"])
+
     def _update_json_schema(self, rows):
-        schema = generate_jsonschema(rows, self.output_table_jsonschema)
+        """Merge the rows with a new column or type in the schema, and save it"""
+        shapes = set(self.shapes)
+        new_rows = []
+        for row in rows:
+            shape = row_shape(row)
+            if not shape <= shapes:
+                new_rows.append(row)
+                shapes |= shape
+        if not new_rows:
+            return self.output_table_jsonschema
+
+        schema = generate_jsonschema(new_rows, self.output_table_jsonschema)
         self.output_table_jsonschema = schema
+        self.output_table_types = jsonschema_to_postgres_types(schema)
+        self.shapes = shapes
+        self.schemas.save(
+            self.output_table, schema, self.output_table_types, self.shapes
+        )
         return schema
 
-    def _update_process_key(self, rows):
-        keys = [row["__key"] for row in rows]
+    def _update_process_key(self, conn, rows):
+        """Mark the input rows processed, in the transaction of their insert.
+        The keys are bound as one array (inlined by psycopg2 as an ARRAY
+        literal: one statement per chunk, its size grows with the chunk).
+        """
         query = f"""
             UPDATE "{self.input_table}"
             SET "{self.process_key}" = TRUE
-            WHERE "{self.primary_key}" IN ({", ".join([f"'{key}'" for key in keys])})
+            WHERE "{self.primary_key}" = ANY(:keys)
         """
-        self.engine.execute(query)
+        conn.execute(text(query), {"keys": [row["__key"] for row in rows]})
 
     def _reset_process_key(self):
+        """Mark the input rows unprocessed, only the ones of `input_sql`: the
+        input table also holds the rows of the other output tables
+        """
         query = f"""
             UPDATE "{self.input_table}"
             SET "{self.process_key}" = FALSE
+            WHERE "{self.primary_key}" IN (
+                SELECT "{self.primary_key}"
+                FROM ({escape_colons(self.input_sql)}) AS t
+            )
         """
-        self.engine.execute(query)
+        self.engine.execute(text(query))
 
-    # TODO: add types comparaison
-    def _check_table_match_rows_columns(self, types):
-        """Check if the columns of the output table match the types of the rows
-        Work only for columns name not types
+    def _output_table_types(self):
+        """Postgres types of the columns of the output table"""
+        rows = self.engine.execute(
+            text(
+                """
+                SELECT column_name, data_type, udt_name
+                FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = :table
+                """
+            ),
+            table=self.output_table,
+        ).all()
+        return {
+            name: column_pg_type(data_type, udt_name)
+            for name, data_type, udt_name in rows
+        }
+
+    def _evolve_table(self):
+        """Add the new columns of the schema to the output table, and widen the
+        columns whose type changed, in place. Raise UpdatedTableException when
+        a column can't be converted (the table is then rebuilt).
         """
-        columns = inspect(self.engine).get_columns(self.output_table)
-        columns_name = {column["name"] for column in columns}
-        rows_columns = types.keys()
-        additional_columns = set(rows_columns) - set(columns_name)
-        if additional_columns:
-            raise UpdatedTableException(
-                f"Columns {additional_columns} are not in the output table"
+        if self.table_types is None:
+            self.table_types = self._output_table_types()
+
+        for key, pg_type in self.output_table_types.items():
+            current = self.table_types.get(key)
+            if current == pg_type:
+                continue
+            if current is None:
+                logger.info(f"Add column {self.output_table}.{key} {pg_type}")
+                query = (
+                    f'ALTER TABLE "{self.output_table}" ADD COLUMN "{key}" {pg_type}'
+                )
+            else:
+                using = alter_column_using(key, current, pg_type)
+                if using is None:
+                    raise UpdatedTableException(
+                        f"Column {key} can't be converted from {current} to {pg_type}"
+                    )
+                logger.info(f"Alter column {self.output_table}.{key} to {pg_type}")
+                query = f"""
+                    ALTER TABLE "{self.output_table}"
+                    ALTER COLUMN "{key}" TYPE {pg_type} USING {using}
+                """
+            self.engine.execute(text(query))
+            self.table_types[key] = pg_type
+
+    def _copy_rows(self, cursor, table, columns, rows):
+        """COPY the rows in the table, as CSV"""
+        types = [self.table_types[column] for column in columns]
+        data = io.StringIO()
+        for row in rows:
+            data.write(
+                ",".join(
+                    copy_field(row.get(column), pg_type)
+                    for column, pg_type in zip(columns, types)
+                )
             )
-        return True
+            data.write("\n")
+        data.seek(0)
+        names = ", ".join(f'"{column}"' for column in columns)
+        cursor.copy_expert(
+            f"""COPY "{table}" ({names}) FROM STDIN WITH (FORMAT csv, NULL '\\N')""",
+            data,
+        )
 
     def _insert_data(self, rows):
-        import pandas as pd
-
+        """Upsert the rows: COPY them in a temporary table, then merge it in the
+        output table with one INSERT ... ON CONFLICT. The column types come from
+        the cached table_types, the table isn't reflected again.
+        """
         print(f"insert_data {self.output_table}: {len(rows)} rows")
-        pg_types = jsonschema_to_postgres_types(self.output_table_jsonschema)
-        dtypes = {k: pg_type_to_sqlalchemy_type(t) for k, t in pg_types.items()}
-
-        self._check_table_match_rows_columns(dtypes)
-
-        df = pd.DataFrame(rows)
-        meta = sa.MetaData(self.engine)
-        upsert_method = create_upsert_method(meta)
-
-        # TODO: have better enforced normalization
-        for key in df.columns:
-            if dtypes[key] == sa.Text:
-                df[key] = df[key].astype(str)
-            elif (
-                str(dtypes[key]) == "ARRAY"
-                and dtypes[key].__repr__() == "ARRAY(Text())"
-            ):
-                # print(f"FIX {key}")
-                df[key] = df[key].apply(fix_array_string)
-
-        df.to_sql(
-            self.output_table,
-            self.engine,
-            index=False,
-            if_exists="append",
-            chunksize=self.chunk_size,
-            method=upsert_method,
-            dtype=dtypes,
-        )
+        self._evolve_table()
 
-        if self.process_key:
-            self._update_process_key(rows)
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        names = ", ".join(f'"{column}"' for column in columns)
+        pkey = self._get_primary_key()
+        updates = ", ".join(
+            f'"{column}" = EXCLUDED."{column}"' for column in columns if column != pkey
+        )
+        on_conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        temp_table = f"__tmp_{self.output_table}"[:63]
+
+        with self.engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            cursor.execute(
+                f"""
+                CREATE TEMPORARY TABLE "{temp_table}"
+                (LIKE "{self.output_table}") ON COMMIT DROP
+                """
+            )
+            self._copy_rows(cursor, temp_table, columns, rows)
+            cursor.execute(
+                f"""
+                INSERT INTO "{self.output_table}" ({names})
+                SELECT {names} FROM "{temp_table}"
+                ON CONFLICT ("{pkey}") {on_conflict}
+                """
+            )
+            if self.process_key:
+                # Committed with the rows: a crash can't leave them half done
+                self._update_process_key(conn, rows)
 
     def run(self):
         table_exist = self._output_table_exist()
@@ -300,22 +425,29 @@ class Transformer:
         if not rows:
             return
 
-        # Get large sample to recreate the jsonschema (hack)
-        rows = self._fetch_rows_to_insert(limit=10000, reset=True)
-        self._update_json_schema(rows)
+        self._load_json_schema()
+        if self.output_table_jsonschema is None:
+            # First run, infer the schema from a sample of the input
+            sample = self._fetch_rows_to_insert(limit=self.schema_sample, reset=True)
+            self._update_json_schema(sample)
         if not table_exist:
             self._create_table()
 
+        last_key = None  # Walk the input once, in primary key order
         while True:
-            rows = self._fetch_rows_to_insert()
+            rows = self._fetch_rows_to_insert(after=last_key)
             if not rows:
                 break
-            self._update_json_schema(rows)
+            if self.infer_changed or any(
+                key not in self.output_table_types for row in rows for key in row
+            ):
+                self._update_json_schema(rows)
             try:
                 self._insert_data(rows)
-            except (UpdatedTableException, Exception) as e:
-                logger.warning("Error while inserting data")
-                logger.warning(e)
+                last_key = rows[-1]["__key"]
+            except UpdatedTableException as e:
+                # Other errors are raised: they don't need a rebuild of the table
+                logger.warning(f"Rebuild {self.output_table}: {e}")
                 self.update_retries += 1
                 if self.update_retries > MAX_RETRIES:
                     raise e
@@ -323,3 +455,4 @@ class Transformer:
                 self._create_table()
                 if self.process_key:
                     self._reset_process_key()
+                last_key = None  # All the rows are inserted again